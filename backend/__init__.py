@@ -1,13 +1,15 @@
 from flask import Flask, session
-from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from dotenv import load_dotenv
 from flask_bcrypt import Bcrypt
 from flask_mail import Mail
 import os
+import socket
 import datetime
 from flask_marshmallow import Marshmallow
+from backend.middleware.sessions import configureSessions
+from backend.middleware.uploads import configureUploads
 
 # This initialization file serves to initialize all variables that will be used throughout the application
 
@@ -25,16 +27,113 @@ app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
-# Encryption package for passwords
+# How http_guard verifies access tokens. 'db' looks the token up in the users table on every request,
+# 'stateless' only checks the JWT signature and expiry locally and relies on the in-process revocation map
+app.config["AUTH_VERIFICATION_MODE"] = os.getenv("AUTH_VERIFICATION_MODE", "db")
+# Maximum number of decoded access tokens kept in the claims cache, 0 disables the cache
+app.config["CLAIMS_CACHE_SIZE"] = int(os.getenv("CLAIMS_CACHE_SIZE", 1024))
+
+# Encryption package for passwords. BCRYPT_LOG_ROUNDS is the bcrypt work factor new hashes use, `flask calibrate-bcrypt`
+# prints the factor meeting BCRYPT_TARGET_MS on the current machine to set here once for every worker
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+app.config["BCRYPT_TARGET_MS"] = int(os.getenv("BCRYPT_TARGET_MS", 250))
+app.config["BCRYPT_MIN_ROUNDS"] = int(os.getenv("BCRYPT_MIN_ROUNDS", 10))
+app.config["BCRYPT_MAX_ROUNDS"] = int(os.getenv("BCRYPT_MAX_ROUNDS", 16))
 bcrypt = Bcrypt(app)
+# Number of native threads hashing and checking passwords, so bcrypt doesn't block the gevent worker. 0 hashes inline
+app.config["PASSWORD_HASH_POOL_SIZE"] = int(os.getenv("PASSWORD_HASH_POOL_SIZE", 2))
 
-# Session configuration, when first running the app, uncomment the section of code below that handles creating the session table
+# Session configuration, when first running the app, uncomment the section of code below that handles creating the session table.
+# SESSION_BACKEND picks where sessions are stored: 'sqlalchemy' (sessions table), 'cookie' (signed cookie, no server storage),
+# 'memory' (in-process LRU, single dyno deployments only) or 'filesystem' (files in SESSION_FILE_DIR)
+app.config["SESSION_BACKEND"] = os.getenv("SESSION_BACKEND", "sqlalchemy")
 app.config["SESSION_TYPE"] = 'sqlalchemy'
 app.config["SESSION_COOKIE_NAME"] = 'access_token'
 app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["SESSION_ALCHEMY"] = db
 app.config["PERMANENT_SESSION_LIFETIME"] = datetime.timedelta(days=0, hours=24000)
-Session(app)
+app.config["SESSION_MEMORY_SIZE"] = int(os.getenv("SESSION_MEMORY_SIZE", 10000))
+app.config["SESSION_FILE_DIR"] = os.getenv("SESSION_FILE_DIR", os.path.join(os.getcwd(), 'flask_session'))
+# Unmodified sessions are only written back once their expiry would move by more than this many seconds
+app.config["SESSION_REFRESH_THRESHOLD"] = int(os.getenv("SESSION_REFRESH_THRESHOLD", 24 * 60 * 60))
+configureSessions(app)
+
+# Expired and orphaned sessions are deleted from the sessions table by `flask sweep-sessions`, or every
+# SESSION_SWEEP_INTERVAL seconds in each gunicorn worker when the interval is greater than 0
+app.config["SESSION_SWEEP_INTERVAL"] = int(os.getenv("SESSION_SWEEP_INTERVAL", 0))
+app.config["SESSION_SWEEP_BATCH_SIZE"] = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", 500))
+
+# Email validation. Login and forgotPassword only check syntax, sign up and email changes also check the domain accepts
+# mail through a per-process cache of DNS results (EMAIL_DOMAIN_CACHE_TTL seconds, EMAIL_DOMAIN_NEGATIVE_TTL for
+# undeliverable domains). EMAIL_CHECK_DELIVERABILITY=false turns the DNS checks off
+app.config["EMAIL_CHECK_DELIVERABILITY"] = os.getenv("EMAIL_CHECK_DELIVERABILITY", "true").lower() == "true"
+app.config["EMAIL_DNS_TIMEOUT"] = int(os.getenv("EMAIL_DNS_TIMEOUT", 5))
+app.config["EMAIL_DOMAIN_CACHE_TTL"] = int(os.getenv("EMAIL_DOMAIN_CACHE_TTL", 60 * 60))
+app.config["EMAIL_DOMAIN_NEGATIVE_TTL"] = int(os.getenv("EMAIL_DOMAIN_NEGATIVE_TTL", 5 * 60))
+app.config["EMAIL_DOMAIN_CACHE_SIZE"] = int(os.getenv("EMAIL_DOMAIN_CACHE_SIZE", 10000))
+
+# Imgur api client. Requests share up to IMGUR_POOL_SIZE keep-alive connections, time out after the connect/read timeouts
+# (seconds) and are retried IMGUR_RETRIES times with jittered backoff. After IMGUR_BREAKER_THRESHOLD consecutive failures
+# requests fail fast for IMGUR_BREAKER_COOLDOWN seconds
+app.config["IMGUR_ROOT_URL"] = os.getenv("IMGUR_ROOT_URL", 'https://imgur-apiv3.p.rapidapi.com/3')
+app.config["IMGUR_POOL_SIZE"] = int(os.getenv("IMGUR_POOL_SIZE", 10))
+app.config["IMGUR_CONNECT_TIMEOUT"] = float(os.getenv("IMGUR_CONNECT_TIMEOUT", 3.05))
+app.config["IMGUR_READ_TIMEOUT"] = float(os.getenv("IMGUR_READ_TIMEOUT", 30))
+app.config["IMGUR_RETRIES"] = int(os.getenv("IMGUR_RETRIES", 2))
+app.config["IMGUR_RETRY_BACKOFF"] = float(os.getenv("IMGUR_RETRY_BACKOFF", 0.5))
+app.config["IMGUR_BREAKER_THRESHOLD"] = int(os.getenv("IMGUR_BREAKER_THRESHOLD", 5))
+app.config["IMGUR_BREAKER_COOLDOWN"] = int(os.getenv("IMGUR_BREAKER_COOLDOWN", 30))
+# Maximum number of check in photos uploaded to imgur at the same time, across all requests in a worker
+app.config["IMGUR_UPLOAD_POOL_SIZE"] = int(os.getenv("IMGUR_UPLOAD_POOL_SIZE", 8))
+
+# PHOTO_STORE picks where check in photos are stored: 'imgur' (anonymous imgur albums) or 'local' (content-addressed files
+# in PHOTO_STORE_DIR served by /photos, with links prefixed by PHOTO_STORE_URL and cached for PHOTO_STORE_CACHE_MAX_AGE seconds)
+app.config["PHOTO_STORE"] = os.getenv("PHOTO_STORE", "imgur")
+app.config["PHOTO_STORE_DIR"] = os.getenv("PHOTO_STORE_DIR", os.path.join(os.getcwd(), 'photo_store'))
+app.config["PHOTO_STORE_URL"] = os.getenv("PHOTO_STORE_URL", "")
+app.config["PHOTO_STORE_CACHE_MAX_AGE"] = int(os.getenv("PHOTO_STORE_CACHE_MAX_AGE", 365 * 24 * 60 * 60))
+
+# Multipart uploads are streamed, file parts larger than UPLOAD_SPOOL_THRESHOLD bytes are spooled to temporary files.
+# Requests larger than UPLOAD_MAX_TOTAL_SIZE or with a part larger than UPLOAD_MAX_PART_SIZE are rejected with a 413
+app.config["UPLOAD_SPOOL_THRESHOLD"] = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", 512 * 1024))
+app.config["UPLOAD_MAX_PART_SIZE"] = int(os.getenv("UPLOAD_MAX_PART_SIZE", 15 * 1024 * 1024))
+app.config["UPLOAD_MAX_TOTAL_SIZE"] = int(os.getenv("UPLOAD_MAX_TOTAL_SIZE", 64 * 1024 * 1024))
+configureUploads(app)
+
+# Check in photos are downscaled so neither side is longer than IMAGE_MAX_DIMENSION and re-encoded as IMAGE_FORMAT at
+# IMAGE_QUALITY without their EXIF data before upload, in a pool of IMAGE_POOL_SIZE processes (0 processes them inline)
+app.config["IMAGE_PROCESSING"] = os.getenv("IMAGE_PROCESSING", "true").lower() == "true"
+app.config["IMAGE_MAX_DIMENSION"] = int(os.getenv("IMAGE_MAX_DIMENSION", 2048))
+app.config["IMAGE_FORMAT"] = os.getenv("IMAGE_FORMAT", "JPEG")
+app.config["IMAGE_QUALITY"] = int(os.getenv("IMAGE_QUALITY", 85))
+app.config["IMAGE_POOL_SIZE"] = int(os.getenv("IMAGE_POOL_SIZE", 2))
+
+# With PHOTO_THUMBNAILS on, the photo upload worker stores a THUMBNAIL_SIZE thumbnail of every check in photo (in both
+# upload modes), check ins return the thumbnails unless the original photos are asked for with originals=true. Photos
+# are spooled for the worker even in 'sync' mode, so only turn it on where the spool constraints of PHOTO_SPOOL_HOST hold
+app.config["PHOTO_THUMBNAILS"] = os.getenv("PHOTO_THUMBNAILS", "false").lower() == "true"
+app.config["THUMBNAIL_SIZE"] = int(os.getenv("THUMBNAIL_SIZE", 320))
+app.config["THUMBNAIL_QUALITY"] = int(os.getenv("THUMBNAIL_QUALITY", 75))
+
+# PHOTO_UPLOAD_MODE 'sync' uploads check in photos to imgur inside submitCheckin. 'background' saves them to PHOTO_SPOOL_DIR
+# and commits the check in right away, the photos are uploaded and their links backfilled by `flask upload-photos` or in
+# each gunicorn worker every PHOTO_UPLOAD_INTERVAL seconds (and as soon as photos are spooled) when the interval is greater than 0
+app.config["PHOTO_UPLOAD_MODE"] = os.getenv("PHOTO_UPLOAD_MODE", "sync")
+app.config["PHOTO_SPOOL_DIR"] = os.getenv("PHOTO_SPOOL_DIR", os.path.join(os.getcwd(), 'photo_spool'))
+# Spooled photos are only uploaded by workers with the PHOTO_SPOOL_HOST that spooled them, since the spool is on local disk.
+# Hosts sharing PHOTO_SPOOL_DIR over shared storage can set the same name. Photos spooled on a host whose disk doesn't
+# survive a restart (e.g. heroku dynos) are lost with it, use 'sync' mode there
+app.config["PHOTO_SPOOL_HOST"] = os.getenv("PHOTO_SPOOL_HOST", socket.gethostname())
+app.config["PHOTO_UPLOAD_INTERVAL"] = int(os.getenv("PHOTO_UPLOAD_INTERVAL", 5))
+app.config["PHOTO_UPLOAD_BATCH_SIZE"] = int(os.getenv("PHOTO_UPLOAD_BATCH_SIZE", 20))
+app.config["PHOTO_UPLOAD_LEASE"] = int(os.getenv("PHOTO_UPLOAD_LEASE", 5 * 60))
+app.config["PHOTO_UPLOAD_RETRY_BASE"] = int(os.getenv("PHOTO_UPLOAD_RETRY_BASE", 30))
+app.config["PHOTO_UPLOAD_RETRY_MAX"] = int(os.getenv("PHOTO_UPLOAD_RETRY_MAX", 60 * 60))
+app.config["PHOTO_UPLOAD_MAX_ATTEMPTS"] = int(os.getenv("PHOTO_UPLOAD_MAX_ATTEMPTS", 6))
+
+# Workers cache the serialized exercise catalog and check the catalog version in the db at most every
+# EXERCISE_CATALOG_CHECK_INTERVAL seconds (0 checks on every request), writes in the worker refresh its cache right away
+app.config["EXERCISE_CATALOG_CHECK_INTERVAL"] = float(os.getenv("EXERCISE_CATALOG_CHECK_INTERVAL", 2))
 
 # Configure flask mail
 app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
@@ -44,8 +143,19 @@ app.config["MAIL_USE_TLS"] = 1
 app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
 app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
 mail = Mail(app)
+# Emails are queued in the Outbox_emails table and sent by `flask dispatch-emails`, or in each gunicorn worker every
+# EMAIL_OUTBOX_INTERVAL seconds (and as soon as an email is queued) when the interval is greater than 0
+app.config["EMAIL_OUTBOX_INTERVAL"] = int(os.getenv("EMAIL_OUTBOX_INTERVAL", 5))
+app.config["EMAIL_OUTBOX_BATCH_SIZE"] = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 50))
+# Seconds a dispatcher holds its claim on a batch, failed emails are retried after EMAIL_OUTBOX_RETRY_BASE seconds,
+# doubling up to EMAIL_OUTBOX_RETRY_MAX, until EMAIL_OUTBOX_MAX_ATTEMPTS attempts have been made
+app.config["EMAIL_OUTBOX_LEASE"] = int(os.getenv("EMAIL_OUTBOX_LEASE", 5 * 60))
+app.config["EMAIL_OUTBOX_RETRY_BASE"] = int(os.getenv("EMAIL_OUTBOX_RETRY_BASE", 30))
+app.config["EMAIL_OUTBOX_RETRY_MAX"] = int(os.getenv("EMAIL_OUTBOX_RETRY_MAX", 60 * 60))
+app.config["EMAIL_OUTBOX_MAX_ATTEMPTS"] = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 8))
 
 # Uncomment these lines below when needing to create a new session table in the db
+# from flask_session import Session
 # session = Session(app)
 # session.app.session_interface.db.create_all()
 
@@ -62,3 +172,8 @@ import backend.auth
 import backend.user
 import backend.coach_templates
 import backend.client_templates
+import backend.photos
+import backend.commands
+
+# The background tasks enabled in the config are started in each gunicorn worker by gunicorn.conf.py, not on import,
+# so `flask` commands, the dev server and the tests don't run them
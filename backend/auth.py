@@ -1,8 +1,11 @@
-from backend import app, bcrypt, mail, db
+from backend import app, db
 from backend.models.user import User, user_schema
 from backend.helpers.emails import forgotPasswordEmail
+from backend.helpers.tokens import revokeToken, revokeUserTokens
+from backend.helpers.passwords import hashPassword, checkPassword, needsRehash
+from backend.helpers.email_validation import validateEmail
 from flask import request, session, redirect
-from email_validator import validate_email, EmailNotValidError
+from email_validator import EmailNotValidError
 import os
 import uuid
 
@@ -16,7 +19,7 @@ def login():
     email = email.lower()
     # Validate that the email is the correct format
     try:
-        v = validate_email(email) # validate and get info
+        v = validateEmail(email) # validate and get info
         email = v["email"] # replace with normalized form
     except EmailNotValidError as e:
         # email is not valid, return error code
@@ -32,11 +35,16 @@ def login():
         }, 404
 
     # Check that the passwords match
-    if not bcrypt.check_password_hash(user.password, body['password'].encode(encoding='utf-8')):
+    if not checkPassword(user.password, body['password']):
         return {
             "error": "Invalid username or password"
         }, 404
 
+    # Rehash passwords hashed with a work factor other than the current BCRYPT_LOG_ROUNDS
+    if needsRehash(user.password):
+        user.password = hashPassword(body['password'])
+        db.session.commit()
+
     token = ''
 
     # If the users access_token is empty, create a new one for them
@@ -102,10 +110,18 @@ def logout():
             "error": "Invalid access token"
         }, 400
 
-    # Set the users access token to an empty string in the db
+    # Set the users access token to an empty string in the db, tokens it replaced no longer fall back to a new login
     user.access_token = ''
+    user.previous_access_token = None
     db.session.commit()
 
+    # Revoke the token for workers verifying tokens statelessly
+    payload = user.decode_auth_payload(token, verify_exp=False)
+    if isinstance(payload, dict):
+        revokeToken(token, payload['exp'])
+    else:
+        revokeToken(token)
+
     # Delete the access_token cookie from session
     session.pop('access_token')
     db.session.close()
@@ -122,7 +138,7 @@ def forgotPassword():
         }, 404
     # validate email format
     try:
-        v = validate_email(email) # validate and get info
+        v = validateEmail(email) # validate and get info
         email = v["email"] # replace with normalized form
     except EmailNotValidError as e:
         # email is not valid, return error code
@@ -145,7 +161,7 @@ def forgotPassword():
     db.session.commit()
 
     # send forgot password email to the user
-    err = forgotPasswordEmail(mail, [email], user.first_name, user.last_name, str(resetToken))
+    err = forgotPasswordEmail([email], user.first_name, user.last_name, str(resetToken))
     if err != None:
         print(err)
         db.session.rollback()
@@ -179,9 +195,13 @@ def resetPassword():
     # If it does, then we set the password field to the new password, and remove the reset_token
     user.reset_token = ''
     # Encrypt the password
-    encodedPassword = bcrypt.generate_password_hash(password).decode(encoding="utf-8")
+    encodedPassword = hashPassword(password)
     user.password = encodedPassword
+    # Log out every session of the user, the next login mints a fresh access_token
+    user.access_token = ''
+    user.previous_access_token = None
     db.session.commit()
+    revokeUserTokens(user.id)
     db.session.close()
 
     # Redirect to the frontend homepage
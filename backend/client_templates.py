@@ -1,12 +1,14 @@
 from backend import db, app
 from backend.middleware.middleware import http_guard
 from backend.models.user import User, Role
-from backend.models.client_templates import ClientTemplate, client_template_schema, client_template_schemas, ClientSession, client_session_schema, ClientExercise, client_exercise_schema, client_session_schemas, TrainingEntry, CheckIn, check_in_schema, check_in_schemas, training_log_schemas
+from backend.models.client_templates import ClientTemplate, client_template_schema, client_template_schemas, ClientSession, client_session_schema, ClientExercise, client_exercise_schema, client_session_schemas, TrainingEntry, CheckIn, check_in_schema, check_in_schemas, check_in_original_schema, check_in_original_schemas, training_log_schemas, PhotoUpload, photo_upload_schemas
 from backend.models.coach_templates import CoachTemplate, CoachSession, CoachExercise, coach_exercise_schema
 from backend.helpers.client_templates import findNextSessionOrder, setNonNullClientTemplateFields, setNonNullClientSessionFields, isSessionPresent, setNonNullCheckinFields, setUpdateSessionFields
 from backend.helpers.general import makeTemplateSlugUnique, paginate
-from backend.helpers.imgur import addImage
+from backend.helpers.albums import ensureAlbum, uploadImages
+from backend.helpers.photo_uploads import spoolPhotos, photo_upload_wakeup
 from flask import request
+from werkzeug.exceptions import RequestEntityTooLarge
 from sqlalchemy.orm import load_only, Load, subqueryload
 from datetime import datetime as dt
 from datetime import date, timedelta
@@ -628,7 +630,11 @@ def getCheckin(token_claims):
         if session.completed == False or session_completed_date > checkin_start_date:
             valid_sessions.append(session)
   
-    checkin_result = check_in_schema.dump(checkin)
+    # photos are returned as thumbnails unless the original photos are asked for
+    if request.args.get('originals') == 'true':
+        checkin_result = check_in_original_schema.dump(checkin)
+    else:
+        checkin_result = check_in_schema.dump(checkin)
     session_result = client_session_schemas.dump(valid_sessions)
 
     return {
@@ -652,8 +658,10 @@ def getCheckins(token_claims):
         # Grab all noncompleted check_ins whos end_date is before todays date. Order this ascending so the oldest one is viewed
         noncompleted_check_ins = CheckIn.query.filter(CheckIn.end_date <= date.today().strftime(DATE_FORMAT), CheckIn.completed == False).order_by(CheckIn.end_date.desc()).all()
 
-        completed_check_ins_result = check_in_schemas.dump(completed_check_ins)
-        noncompleted_check_ins_result = check_in_schemas.dump(noncompleted_check_ins)
+        # photos are returned as thumbnails unless the original photos are asked for
+        schema = check_in_original_schemas if request.args.get('originals') == 'true' else check_in_schemas
+        completed_check_ins_result = schema.dump(completed_check_ins)
+        noncompleted_check_ins_result = schema.dump(noncompleted_check_ins)
 
         return {
             "completed": completed_check_ins_result,
@@ -703,8 +711,10 @@ def getClientCheckins(token_claims):
     # sort the incompleted checkins by start_date
     incomplete_checkins = sorted(incomplete_checkins, key=lambda k: k.start_date, reverse=True)
 
-    complete_checkin_results = check_in_schemas.dump(complete_checkins)
-    incomplete_checkin_results = check_in_schemas.dump(incomplete_checkins)
+    # photos are returned as thumbnails unless the original photos are asked for
+    schema = check_in_original_schemas if request.args.get('originals') == 'true' else check_in_schemas
+    complete_checkin_results = schema.dump(complete_checkins)
+    incomplete_checkin_results = schema.dump(incomplete_checkins)
 
     return {
         "completed": complete_checkin_results,
@@ -717,6 +727,9 @@ def submitCheckin(token_claims):
     try:
         form = request.form['body']
         body = json.loads(form)
+    except RequestEntityTooLarge:
+        # photos over the upload limits, answered with a 413
+        raise
     except Exception as e:
         body = request.get_json(force=True)
 
@@ -755,10 +768,14 @@ def submitCheckin(token_claims):
     else:
         client_session_results = None
     
+    # timings of the slow parts of the request, returned with the response
+    diagnostics = {}
+    # photos spooled for a background upload
+    uploads = []
+
     # update the check_in fields as necessary
     if 'check_in' in body:
         checkin = CheckIn.query.filter_by(id=body['check_in']['id']).first()
-        setNonNullCheckinFields(checkin, body['check_in'])
 
         # post an image to imgur if this endpoint is not being run by a test
         create_image = True
@@ -777,45 +794,38 @@ def submitCheckin(token_claims):
                 "error": "No user found with client_template_id: " + str(body['check_in']['id'])
             }, 404
         
-        if create_image:
-            # get the album the image needs to be added to
-            album = user.album_deletehash              
-            if 'front' in request.files:
-                front = request.files['front']
-                image_link, code = addImage(album, front)
-                if code != 200:
-                    print("Failed to add front image to imgur album for user with code: " + str(code))
-                    return {
-                        "error": "Internal Server Error"
-                    }, 500
-                checkin.front = image_link
-            if 'back' in request.files:
-                back = request.files['back']
-                image_link, code = addImage(album, back)
-                if code != 200:
-                    print("Failed to add back image to imgur album for user with code: " + str(code))
-                    return {
-                        "error": "Internal Server Error"
-                    }, 500
-                checkin.back = image_link
-            if 'side_a' in request.files:
-                side_a = request.files['side_a']
-                image_link, code = addImage(album, side_a)
-                if code != 200:
-                    print("Failed to add side_a image to imgur album for user with code: " + str(code))
-                    return {
-                        "error": "Internal Server Error"
-                    }, 500
-                checkin.side_a = image_link
-            if 'side_b' in request.files:
-                side_b = request.files['side_b']
-                image_link, code = addImage(album, side_b)
-                if code != 200:
-                    print("Failed to add side_b image to imgur album for user with code: " + str(code))
-                    return {
-                        "error": "Internal Server Error"
-                    }, 500
-                checkin.side_b = image_link
+        images = [name for name in ['front', 'back', 'side_a', 'side_b'] if name in request.files]
+        background = app.config["PHOTO_UPLOAD_MODE"] == 'background'
+        if create_image and len(images) != 0 and not background:
+            # get the album the image needs to be added to, creating it on the users first upload. This commits, so it
+            # runs before the checkin is modified
+            album, code = ensureAlbum(user)
+            if album == None:
+                return {
+                    "error": "Internal Server Error"
+                }, 500
+
+        setNonNullCheckinFields(checkin, body['check_in'])
+
+        if create_image and len(images) != 0 and background:
+            # spool the images, they are uploaded and backfilled into the checkin by the photo upload worker
+            uploads = spoolPhotos(checkin, user, {name: request.files[name] for name in images})
+        elif create_image and len(images) != 0:
+            # upload the images concurrently, the checkin is only updated if every upload succeeded
+            links, timings = uploadImages(album, {name: request.files[name] for name in images})
+            diagnostics['uploads'] = timings
+            if links == None:
+                return {
+                    "error": "Internal Server Error",
+                    "diagnostics": diagnostics
+                }, 500
+            for name, link in links.items():
+                setattr(checkin, name, link)
+                # a new photo replaces the thumbnail of the old one until the worker backfills its own
+                setattr(checkin, name + '_thumbnail', None)
+            if app.config["PHOTO_THUMBNAILS"]:
+                # spool the uploaded images so the photo upload worker makes their thumbnails
+                uploads = spoolPhotos(checkin, user, {name: request.files[name] for name in images}, links)
 
     # set user.check_in to true only if a client has accessed this endpoint
     if token_claims['role'] == Role.CLIENT.name:
@@ -832,8 +842,28 @@ def submitCheckin(token_claims):
         }, 500
         raise
     check_in_result = check_in_schema.dump(checkin)
+    if len(uploads) != 0:
+        photo_upload_wakeup.set()
     
     return {
         "check_in": check_in_result,
-        "sessions": client_session_results
+        "sessions": client_session_results,
+        "uploads": photo_upload_schemas.dump(uploads),
+        "diagnostics": diagnostics
+    }
+
+@app.route("/checkin/photos", methods=["GET"])
+@http_guard(renew=True, nullable=False)
+def getCheckinPhotos(token_claims):
+    checkin_id = request.args.get('checkin_id')
+    if checkin_id == None:
+        return {
+            "error": "checkin_id not found in query parameter"
+        }, 400
+
+    # every photo submitted for the checkin with the status of its upload, the latest photo for a field is last
+    uploads = PhotoUpload.query.filter_by(check_in_id=checkin_id).order_by(PhotoUpload.id).all()
+
+    return {
+        "uploads": photo_upload_schemas.dump(uploads)
     }
@@ -1,12 +1,14 @@
 from backend import app, db
 from backend.middleware.middleware import http_guard
-from flask import request, session
+from flask import request, session, json
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 # from sqlalchemy.orm import defer, joinedload, load_only, subqueryload, lazyload
 from backend.models.user import Role
 from backend.models.coach_templates import CoachTemplate, coach_template_schema, coach_template_schemas, coach_session_schema, coach_session_schemas, Exercise, coach_exercise_schema, CoachSession, coach_exercise_schemas, CoachExercise, exercise_schemas, exercise_schema
-from backend.helpers.coach_templates import setNonNullCoachSessionFields, isSessionPresent
+from backend.helpers.coach_templates import setNonNullCoachSessionFields, isSessionPresent, buildCoachExercises
+from backend.helpers.exercise_catalog import getCatalog, bumpCatalogVersion, catalogChanges, catalogETag
 from slugify import slugify
 
 # Iteration 2
@@ -20,17 +22,44 @@ def coachTemplates(token_claims):
             "error": "Expected role of COACH"
     }, 401
 
-    templates = CoachTemplate.query.all()
-
-    if templates == None:
+    # Templates are listed by id. With limit they are returned in pages, after is the id of the last template of the
+    # previous page (the "next" value of its response). coach_id only lists the templates created by that coach
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        after = int(request.args['after']) if 'after' in request.args else None
+        coach_id = int(request.args['coach_id']) if 'coach_id' in request.args else None
+    except ValueError:
         return {
-            "error": "There are no Coach_templates"
-        }, 404
+            "error": "limit, after and coach_id must be integers"
+        }, 400
+    if limit != None and limit < 1:
+        return {
+            "error": "limit must be greater than 0"
+        }, 400
+
+    # the sessions of every template in the page are loaded in one extra query
+    templates = CoachTemplate.query.options(
+        selectinload(CoachTemplate.sessions).load_only('id', 'name', 'slug', 'order', 'coach_template_id')
+    ).order_by(CoachTemplate.id)
+    if coach_id != None:
+        templates = templates.filter(CoachTemplate.coach_id == coach_id)
+    if after != None:
+        templates = templates.filter(CoachTemplate.id > after)
+    if limit != None:
+        # one extra template tells if there is a next page
+        templates = templates.limit(limit + 1)
+    templates = templates.all()
+
+    next_page = None
+    if limit != None and len(templates) > limit:
+        templates = templates[:limit]
+        next_page = templates[-1].id
 
     result = coach_template_schemas.dump(templates)
 
     return {
-        "templates": result
+        "templates": result,
+        "next": next_page
     }
 
 # Return the coach_template from coach_template_id passed in
@@ -156,18 +185,29 @@ def exercises(token_claims):
             "error": "Expected role of COACH"
     }, 401
     
-    exercises = Exercise.query.all()
-
-    if exercises == None:
+    try:
+        since = int(request.args['since']) if 'since' in request.args else None
+    except ValueError:
         return {
-            "error": "No exercises have been created yet"
-        }, 404
-
-    result = exercise_schemas.dump(exercises)
+            "error": "since must be an integer"
+        }, 400
 
-    return {
-        "exercises": result
-    }
+    # the catalog is served from the worker's cache of the serialized catalog
+    version, body = getCatalog()
+    etag = catalogETag(version)
+    # clients that have the current version get a 304 without a body
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    elif since != None:
+        # only the exercises added or changed after the version the client has
+        resp = app.response_class(json.dumps({
+            "exercises": exercise_schemas.dump(catalogChanges(since)),
+            "version": version
+        }), mimetype='application/json')
+    else:
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    return resp
 
 
 @app.route("/coach/template", methods=['POST'])
@@ -202,38 +242,27 @@ def createTemplate(token_claims):
     # If the template name is free, then we create a slug from it
     template_slug = slugify(body['name'])
     
-    new_template = CoachTemplate(name=body['name'], sessions=[], slug=template_slug)
+    # the coach exercises of every session, and any new exercises, are created in one batch and committed once
+    try:
+        session_exercises = buildCoachExercises([session['coach_exercises'] for session in body['sessions']])
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return {
+            "error": "Internal Server Error"
+        }, 500
+    if session_exercises == None:
+        return {
+            "error": "Each coach_exercise needs to specify an exercise_id OR a category and name pair"
+        }, 400
+
+    new_template = CoachTemplate(name=body['name'], sessions=[], slug=template_slug, coach_id=token_claims['id'])
     # Enter each session and its corresponding coach exercises into the template
-    for session in body['sessions']:
+    for session, coach_exercises in zip(body['sessions'], session_exercises):
         session_slug = slugify(session['name'])
         coach_session = CoachSession(
-            name=session['name'], slug=session_slug, order=session['order'], coach_exercises=[]
+            name=session['name'], slug=session_slug, order=session['order'], coach_exercises=coach_exercises
         )
-        for coach_exercise in session['coach_exercises']:
-            # Check if the exercise_id was supplied, if not then create a new exercise using the category and name
-            if 'exercise_id' not in coach_exercise:
-                if 'category' not in coach_exercise or 'name' not in coach_exercise:
-                    return {
-                        "error": "Each coach_exercise needs to specify an exercise_id OR a category and name pair"
-                    }, 400
-                exercise = Exercise(category=coach_exercise['category'], name=coach_exercise['name'])
-                db.session.add(exercise)
-                try:
-                    db.session.commit()
-                    db.session.refresh(exercise)
-                except Exception as e:
-                    return {
-                        "error": "Internal Server Error"
-                    }, 500
-
-                coach_session.coach_exercises.append(CoachExercise(
-                    exercise_id=exercise.id, order=coach_exercise['order']
-                ))
-            else:
-                coach_session.coach_exercises.append(CoachExercise(
-                    exercise_id=coach_exercise['exercise_id'], order=coach_exercise['order']
-                ))
-
         new_template.sessions.append(coach_session)
     
     try:
@@ -242,6 +271,7 @@ def createTemplate(token_claims):
         db.session.commit()
     except Exception as e:
         print(e)
+        db.session.rollback()
         return {
             "error": "Internal Server Error"
         }, 500
@@ -302,38 +332,27 @@ def createSession(token_claims):
         order=max_order, coach_exercises=[]
     )
 
-    # Check if they passed in coach_exercises
+    # Check if they passed in coach_exercises, they are created in one batch with any new exercises and committed once
     if 'coach_exercises' in body:
-        for coach_exercise in body['coach_exercises']:
-            # Check if the exercise_id was supplied, if not then create a new exercise using the category and name
-            if 'exercise_id' not in coach_exercise:
-                if 'category' not in coach_exercise or 'name' not in coach_exercise:
-                    return {
-                        "error": "Each coach_exercise needs to specify an exercise_id OR a category and name pair"
-                    }, 400
-                exercise = Exercise(category=coach_exercise['category'], name=coach_exercise['name'])
-                db.session.add(exercise)
-                try:
-                    db.session.commit()
-                    db.session.refresh(exercise)
-                except Exception as e:
-                    return {
-                        "error": "Internal Server Error"
-                    }, 500
-
-                new_session.coach_exercises.append(CoachExercise(
-                    exercise_id=exercise.id, order=coach_exercise['order']
-                ))
-            else:
-                new_session.coach_exercises.append(CoachExercise(
-                    exercise_id=coach_exercise['exercise_id'], order=coach_exercise['order']
-                ))
+        try:
+            session_exercises = buildCoachExercises([body['coach_exercises']])
+        except Exception as e:
+            db.session.rollback()
+            return {
+                "error": "Internal Server Error"
+            }, 500
+        if session_exercises == None:
+            return {
+                "error": "Each coach_exercise needs to specify an exercise_id OR a category and name pair"
+            }, 400
+        new_session.coach_exercises = session_exercises[0]
     
     try:
         # create new template in CoachTemplate table
         db.session.add(new_session)
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         return {
             "error": "Internal Server Error"
         }, 500
@@ -367,6 +386,7 @@ def createExercise(token_claims):
     try:
         # create new template in CoachTemplate table
         db.session.add(new_exercise)
+        new_exercise.version = bumpCatalogVersion()
         db.session.commit()
     except Exception as e:
         return {
@@ -374,12 +394,10 @@ def createExercise(token_claims):
         }, 500
         raise
 
-    # retrieve created exercises
-    exercises = Exercise.query.all()
-    result = exercise_schemas.dump(exercises)
-    
+    # clients add the new exercise to their copy of the catalog, which is then at the new version
     return {
-        "exercises": result
+        "exercises": [exercise_schema.dump(new_exercise)],
+        "version": new_exercise.version
     }
 
 
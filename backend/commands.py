@@ -0,0 +1,38 @@
+from backend import app
+from backend.helpers.session_sweeper import sweepSessions
+from backend.helpers.passwords import calibrateRounds, timeHash
+from backend.helpers.outbox import drainOutbox
+from backend.helpers.photo_uploads import drainPhotoUploads
+import click
+
+# CLI commands, run with `flask <command>` (e.g. env FLASK_APP=backend flask sweep-sessions)
+
+@app.cli.command("sweep-sessions")
+@click.option("--batch-size", type=int, default=None, help="Rows deleted per statement")
+def sweepSessionsCommand(batch_size):
+    """Deletes expired and orphaned sessions from the sessions table"""
+    result = sweepSessions(batch_size)
+    if result == None:
+        print("SESSION_BACKEND is " + app.config["SESSION_BACKEND"] + ", there is no sessions table to sweep")
+        return
+    print("Reclaimed " + str(result['expired'] + result['orphaned']) + " sessions")
+
+@app.cli.command("calibrate-bcrypt")
+@click.option("--target-ms", type=int, default=None, help="Target hash latency in milliseconds")
+def calibrateBcryptCommand(target_ms):
+    """Prints the bcrypt work factor meeting the target hash latency on this machine"""
+    rounds = calibrateRounds(target_ms)
+    print("Current BCRYPT_LOG_ROUNDS is " + str(app.config["BCRYPT_LOG_ROUNDS"]) + " (" + str(round(timeHash(app.config["BCRYPT_LOG_ROUNDS"]))) + "ms per hash)")
+    print("Set BCRYPT_LOG_ROUNDS=" + str(rounds) + " for every worker to use the calibrated work factor, passwords hashed with fewer rounds are rehashed on login")
+
+@app.cli.command("dispatch-emails")
+@click.option("--batch-size", type=int, default=None, help="Emails sent per SMTP connection")
+def dispatchEmailsCommand(batch_size):
+    """Sends the due emails in the outbox"""
+    print("Sent " + str(drainOutbox(batch_size)) + " emails")
+
+@app.cli.command("upload-photos")
+@click.option("--batch-size", type=int, default=None, help="Photos uploaded concurrently")
+def uploadPhotosCommand(batch_size):
+    """Uploads the due spooled check in photos and their thumbnails and backfills their links"""
+    print("Uploaded " + str(drainPhotoUploads(batch_size)) + " photos")
@@ -0,0 +1,137 @@
+from backend import app, db
+from backend.models.user import User
+from backend.helpers.photo_store import createAlbum, deleteAlbum, addImage, deleteImage
+from backend.helpers.pools import WorkerPool
+from backend.helpers.images import prepareUpload
+import threading
+import time
+
+# Seconds a request waits for an album another request in this worker is creating for the same user
+ALBUM_WAIT_TIMEOUT = 10
+
+# Album creations in flight in this worker, keyed by user id
+_album_creations = {}
+_album_creations_lock = threading.Lock()
+
+# Check in photos are uploaded concurrently, as greenlets under the gevent worker
+upload_pool = WorkerPool('imgur-uploads', app.config["IMGUR_UPLOAD_POOL_SIZE"], greenlets=True)
+
+def ensureAlbum(user):
+    """
+    Returns the photo album of a user, creating it in the photo store on first use. Creation is single-flight: within a worker only the first
+    request creates the album and concurrent requests for the same user wait for it. Across workers the album is only
+    stored if the user still has none (compare-and-swap), otherwise the album stored by the other worker is used and
+    the extra one is deleted
+    Arguments:
+        - user (User): user the album belongs to
+    Returns:
+        - album_deletehash, used to add images to the album
+        - status code
+    """
+    if user.album_deletehash != None:
+        return user.album_deletehash, 200
+
+    with _album_creations_lock:
+        creation = _album_creations.get(user.id)
+        leader = creation == None
+        if leader:
+            creation = threading.Event()
+            _album_creations[user.id] = creation
+
+    if leader:
+        try:
+            return provisionAlbum(user)
+        finally:
+            with _album_creations_lock:
+                del _album_creations[user.id]
+            creation.set()
+
+    # Picks up the album the leader stored, or creates one if the leader failed or took too long
+    creation.wait(ALBUM_WAIT_TIMEOUT)
+    return provisionAlbum(user)
+
+def provisionAlbum(user):
+    """
+    Creates an album in the photo store and stores it on the user unless another worker stored one first
+    Returns:
+        - album_deletehash of the users album, or None if the photo store failed
+        - status code
+    """
+    # Another worker may have created the album since the user was loaded
+    album_id, album_deletehash = db.session.query(User.album_id, User.album_deletehash).filter_by(id=user.id).first()
+    if album_deletehash == None:
+        album_id, album_deletehash, code = createAlbum()
+        if code != 200:
+            print("Failed to create photo album for user with code: " + str(code))
+            return None, code
+
+        stored = User.query.filter_by(id=user.id, album_deletehash=None).update(
+            {'album_id': album_id, 'album_deletehash': album_deletehash}, synchronize_session=False
+        )
+        db.session.commit()
+        if stored == 0:
+            # Lost the race, keep the album the other worker stored and remove ours
+            try:
+                code = deleteAlbum(album_deletehash)
+                if code != 200:
+                    print("Failed to delete duplicate photo album with code: " + str(code))
+            except Exception as e:
+                print("Failed to delete duplicate photo album: " + str(e))
+            album_id, album_deletehash = db.session.query(User.album_id, User.album_deletehash).filter_by(id=user.id).first()
+
+    user.album_id = album_id
+    user.album_deletehash = album_deletehash
+    return album_deletehash, 200
+
+def uploadImages(album, images):
+    """
+    Uploads images to an album concurrently. Uploads are all-or-nothing, if any image fails the images that were
+    uploaded are deleted again
+    Arguments:
+        - album (string): album_deletehash of the album
+        - images (dict): image files keyed by name (front, back, side_a, side_b)
+    Returns:
+        - dictionary of image links keyed by name, or None if an upload failed
+        - dictionary of {"status", "ms", "bytes_saved"} upload diagnostics keyed by name
+    """
+    names = list(images.keys())
+    results = upload_pool.runAll(_timedUpload, [(album, images[name]) for name in names])
+
+    uploads = {}
+    diagnostics = {}
+    failed = False
+    for name, (upload, error) in zip(names, results):
+        if error != None:
+            print("Failed to add " + name + " image to photo album: " + str(error))
+            diagnostics[name] = {"status": None, "ms": None, "bytes_saved": None}
+            failed = True
+            continue
+
+        diagnostics[name] = {"status": upload['status'], "ms": upload['ms'], "bytes_saved": upload['bytes_saved']}
+        if upload['status'] != 200:
+            print("Failed to add " + name + " image to photo album for user with code: " + str(upload['status']))
+            failed = True
+        else:
+            uploads[name] = upload
+
+    if failed:
+        for upload in uploads.values():
+            try:
+                deleteImage(upload['deletehash'])
+            except Exception as e:
+                print("Failed to delete photo after a failed upload: " + str(e))
+        return None, diagnostics
+
+    return {name: upload['link'] for name, upload in uploads.items()}, diagnostics
+
+def _timedUpload(album, image):
+    start = time.perf_counter()
+    upload, bytes_saved = prepareUpload(image)
+    link, deletehash, code = addImage(album, upload)
+    return {
+        "link": link,
+        "deletehash": deletehash,
+        "status": code,
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+        "bytes_saved": bytes_saved
+    }
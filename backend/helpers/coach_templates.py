@@ -1,6 +1,7 @@
 from backend import db
 from sqlalchemy import func
-from backend.models.coach_templates import CoachSession
+from backend.models.coach_templates import CoachSession, CoachExercise, Exercise
+from backend.helpers.exercise_catalog import bumpCatalogVersion
 
 def setNonNullCoachSessionFields(coach_session, fields):
     """
@@ -32,3 +33,42 @@ def isSessionPresent(coach_session, sessions):
             return True, i
     
     return False, -1
+
+def buildCoachExercises(coach_exercise_lists):
+    """
+    Builds the CoachExercises of one or more sessions in a single batch. Coach exercises without an exercise_id create
+    a new Exercise from their category and name, the new exercises are flushed together (one catalog version for all of
+    them) so their ids are known, nothing is committed. Every coach_exercise is validated before anything is added
+    to the db session
+        - coach_exercise_lists: the coach_exercises list of each session
+            [
+                [{"exercise_id": 1, "order": 1}, {"category": "Back", "name": "Rows", "order": 2}]
+            ]
+        - returns
+            1. list of CoachExercise lists, one per session, or None if a coach_exercise is invalid
+    """
+    for coach_exercises in coach_exercise_lists:
+        for coach_exercise in coach_exercises:
+            if 'exercise_id' not in coach_exercise and ('category' not in coach_exercise or 'name' not in coach_exercise):
+                return None
+
+    new_exercises = {}
+    for coach_exercises in coach_exercise_lists:
+        for coach_exercise in coach_exercises:
+            if 'exercise_id' not in coach_exercise:
+                new_exercises[id(coach_exercise)] = Exercise(category=coach_exercise['category'], name=coach_exercise['name'])
+    if len(new_exercises) != 0:
+        version = bumpCatalogVersion()
+        for exercise in new_exercises.values():
+            exercise.version = version
+        db.session.add_all(new_exercises.values())
+        db.session.flush()
+
+    return [
+        [
+            CoachExercise(
+                exercise_id=coach_exercise['exercise_id'] if 'exercise_id' in coach_exercise else new_exercises[id(coach_exercise)].id,
+                order=coach_exercise['order']
+            ) for coach_exercise in coach_exercises
+        ] for coach_exercises in coach_exercise_lists
+    ]
@@ -0,0 +1,115 @@
+from backend import app
+from email_validator import validate_email, EmailUndeliverableError
+from collections import OrderedDict
+import email_validator
+import threading
+import time
+
+# Deliverability results keyed by domain, shared by every request in the process. Undeliverable domains are cached
+# for EMAIL_DOMAIN_NEGATIVE_TTL seconds, resolver timeouts aren't cached at all
+_domain_cache = OrderedDict()
+_domain_cache_lock = threading.Lock()
+_domain_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "resolver_calls": 0,
+    "resolver_ms": 0.0,
+    "resolver_max_ms": 0.0
+}
+
+def validateEmail(email, check_deliverability=False):
+    """
+    Validates the syntax of an email address and, when check_deliverability is set, that its domain accepts mail.
+    Syntax checks never leave the process so they're cheap enough for login, deliverability checks go through
+    the domain cache and are meant for addresses being stored (sign up, email changes)
+    Arguments:
+        - email (string): email address to validate
+        - check_deliverability (bool): also check the domain has MX (or A/AAAA) records, ignored when
+          EMAIL_CHECK_DELIVERABILITY is off
+    Returns:
+        - email_validator's validation result, v["email"] is the normalized address
+    Raises:
+        - EmailNotValidError if the address is invalid or undeliverable
+    """
+    v = validate_email(email, check_deliverability=False)
+    if check_deliverability and app.config["EMAIL_CHECK_DELIVERABILITY"]:
+        domainDeliverability(v["domain"], v["domain_i18n"])
+    return v
+
+def domainDeliverability(domain, domain_i18n):
+    """
+    Looks up whether a domain accepts mail, resolving it only when it isn't in the domain cache
+    Returns:
+        - email_validator's deliverability info for the domain
+    Raises:
+        - EmailUndeliverableError if the domain doesn't accept mail
+    """
+    now = time.time()
+    with _domain_cache_lock:
+        entry = _domain_cache.get(domain)
+        if entry != None and entry['expires'] <= now:
+            del _domain_cache[domain]
+            entry = None
+        if entry != None:
+            _domain_cache.move_to_end(domain)
+            _domain_cache_stats["hits"] += 1
+        else:
+            _domain_cache_stats["misses"] += 1
+
+    if entry == None:
+        entry = _resolveDomain(domain, domain_i18n)
+
+    if entry['error'] != None:
+        raise EmailUndeliverableError(entry['error'])
+    return entry['info']
+
+def _resolveDomain(domain, domain_i18n):
+    start = time.perf_counter()
+    info = None
+    error = None
+    try:
+        info = email_validator.validate_email_deliverability(domain, domain_i18n, app.config["EMAIL_DNS_TIMEOUT"])
+    except EmailUndeliverableError as e:
+        error = str(e)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    entry = {
+        "info": info,
+        "error": error,
+        "expires": time.time() + (app.config["EMAIL_DOMAIN_CACHE_TTL"] if error == None else app.config["EMAIL_DOMAIN_NEGATIVE_TTL"])
+    }
+
+    max_size = app.config["EMAIL_DOMAIN_CACHE_SIZE"]
+    with _domain_cache_lock:
+        _domain_cache_stats["resolver_calls"] += 1
+        _domain_cache_stats["resolver_ms"] += elapsed
+        _domain_cache_stats["resolver_max_ms"] = max(_domain_cache_stats["resolver_max_ms"], elapsed)
+        # A timed out lookup says nothing about the domain, so it is retried on the next request
+        if max_size > 0 and (info == None or "unknown-deliverability" not in info):
+            _domain_cache[domain] = entry
+            _domain_cache.move_to_end(domain)
+            while len(_domain_cache) > max_size:
+                _domain_cache.popitem(last=False)
+    return entry
+
+def emailValidationStats():
+    """
+    Returns the domain cache hit and miss counters, its size and the resolver latency
+    """
+    with _domain_cache_lock:
+        calls = _domain_cache_stats["resolver_calls"]
+        return {
+            "hits": _domain_cache_stats["hits"],
+            "misses": _domain_cache_stats["misses"],
+            "size": len(_domain_cache),
+            "resolver_calls": calls,
+            "resolver_average_ms": (_domain_cache_stats["resolver_ms"] / calls) if calls != 0 else 0,
+            "resolver_max_ms": _domain_cache_stats["resolver_max_ms"]
+        }
+
+def clearDomainCache():
+    """
+    Empties the domain cache, counters are kept
+    """
+    with _domain_cache_lock:
+        _domain_cache.clear()
@@ -1,70 +1,98 @@
-from flask_mail import Mail, Message
-from flask import render_template
+from flask_mail import Message
+from jinja2 import Template
 from backend import app
+from backend.helpers.outbox import queueEmails
 import os
 
-def sendVerificationEmail(mail, to, first_name, last_name, verification_token):
-    # Create the callback URL
-    callback = ''
-    if app.config["ENV"] == 'development':
-        callback = os.getenv("DEV_BACKEND_URL")
-    else:
-        callback = os.getenv("PROD_BACKEND_URL")
-    callback = callback + 'verifyUser?email=' + to[0] + '&' + 'verification_token=' + verification_token
+SENDER = "we.coach.easy@gmail.com"
 
-    try:
-        msg = Message(
-            "Welcome To Coach Easy!",
-            sender="we.coach.easy@gmail.com",
-            recipients=to
-        )
-        msg.body = 'Hello ' + first_name + ' ' + last_name + ',\n' + "Welcome to Coach Easy! We're excited to have you on board and to help you reach your fitness goals. Please click on the link below to verify your email and to make sure that we've got the right email address.\n" + "Please keep in mind that you won't be able to login until your coach has approved you. You will receive a follow up email when you've been approved.\n" + callback
-        msg.html = render_template("welcome.html", name=first_name+' '+last_name, callback=callback)
-        mail.send(msg)
-        return None
-    except Exception as e:
-        return e
+# Callback URL bases, read once when the app starts. Approval and forgot password emails link to the frontend URL
+# of the other environment
+if app.config["ENV"] == 'development':
+    BACKEND_URL = os.getenv("DEV_BACKEND_URL", '')
+    FRONTEND_URL = os.getenv("PROD_FRONTEND_URL", '')
+else:
+    BACKEND_URL = os.getenv("PROD_BACKEND_URL", '')
+    FRONTEND_URL = os.getenv("DEV_FRONTEND_URL", '')
 
-def sendApprovedEmail(mail, to, first_name, last_name):
-    # Create the callback URL
-    callback = ''
-    if app.config["ENV"] == 'development':
-        callback = os.getenv("PROD_FRONTEND_URL")
-    else:
-        callback = os.getenv("DEV_FRONTEND_URL")
-    callback = callback + 'login'
+class EmailTemplate(object):
+    """
+    An email with an html part rendered from backend/templates and a plain text part rendered from an inline template.
+    Both are compiled once when the app starts (template changes need a restart) and rendered from the same parameters
 
-    try:
-        msg = Message(
-            "You've Been Approved!",
-            sender="we.coach.easy@gmail.com",
-            recipients=to
-        )
-        msg.body = 'Hello ' + first_name + ' ' + last_name + ',\n' + "You've been successfully approved. You are now able to login to your account.\n" + callback
-        msg.html = render_template("approved.html", name=first_name+' '+last_name, callback=callback)
-        mail.send(msg)
-        return None
-    except Exception as e:
-        return e
+    :param subject: subject line of the email.
+    :param html_template: file name of the html template.
+    :param text: jinja source of the plain text part, it isn't autoescaped.
+    """
+
+    def __init__(self, subject, html_template, text):
+        self.subject = subject
+        self.html = app.jinja_env.get_template(html_template)
+        self.text = Template(text)
+
+    def render(self, to, **params):
+        """
+        Returns a Message to the recipients in to with both parts rendered from params
+        """
+        msg = Message(self.subject, sender=SENDER, recipients=to)
+        msg.body = self.text.render(params)
+        msg.html = self.html.render(params)
+        return msg
+
+    def renderBatch(self, recipients):
+        """
+        Renders one Message per (to, params) pair in recipients
+        """
+        return [self.render(to, **params) for to, params in recipients]
+
+WELCOME_EMAIL = EmailTemplate(
+    "Welcome To Coach Easy!",
+    "welcome.html",
+    "Hello {{ name }},\n" +
+    "Welcome to Coach Easy! We're excited to have you on board and to help you reach your fitness goals. Please click on the link below to verify your email and to make sure that we've got the right email address.\n" +
+    "Please keep in mind that you won't be able to login until your coach has approved you. You will receive a follow up email when you've been approved.\n" +
+    "{{ callback }}"
+)
+
+APPROVED_EMAIL = EmailTemplate(
+    "You've Been Approved!",
+    "approved.html",
+    "Hello {{ name }},\n" +
+    "You've been successfully approved. You are now able to login to your account.\n" +
+    "{{ callback }}"
+)
+
+FORGOT_PASSWORD_EMAIL = EmailTemplate(
+    "Forgot Password?",
+    "forgotPassword.html",
+    "Hello {{ name }},\n" +
+    "Reset password by clicking the button below.\n" +
+    "{{ callback }}"
+)
+
+def sendVerificationEmail(to, first_name, last_name, verification_token):
+    callback = BACKEND_URL + 'verifyUser?email=' + to[0] + '&' + 'verification_token=' + verification_token
+    return sendBatch(WELCOME_EMAIL, [(to, {"name": first_name + ' ' + last_name, "callback": callback})])
+
+def sendApprovedEmail(to, first_name, last_name):
+    callback = FRONTEND_URL + 'login'
+    return sendBatch(APPROVED_EMAIL, [(to, {"name": first_name + ' ' + last_name, "callback": callback})])
 
-def forgotPasswordEmail(mail, to, first_name, last_name, reset_token):
-    # Create the callback URL
-    callback = ''
-    if app.config["ENV"] == 'development':
-        callback = os.getenv("PROD_FRONTEND_URL")
-    else:
-        callback = os.getenv("DEV_FRONTEND_URL")
-    callback = callback + 'resetPassword?reset_token=' + reset_token
+def forgotPasswordEmail(to, first_name, last_name, reset_token):
+    callback = FRONTEND_URL + 'resetPassword?reset_token=' + reset_token
+    return sendBatch(FORGOT_PASSWORD_EMAIL, [(to, {"name": first_name + ' ' + last_name, "callback": callback})])
 
+def sendBatch(template, recipients):
+    """
+    Renders an email for every recipient and queues them all in the outbox in one transaction, used for bulk sends
+    Arguments:
+        - template (EmailTemplate): email to send
+        - recipients (list): (to, params) pairs, to is a list of addresses and params the template parameters
+    Returns:
+        - None, or the exception raised while rendering or queueing the emails
+    """
     try:
-        msg = Message(
-            "Forgot Password?",
-            sender="we.coach.easy@gmail.com",
-            recipients=to
-        )
-        msg.body = 'Hello ' + first_name + ' ' + last_name + ',\n' + "Reset password by clicking the button below.\n" + callback
-        msg.html = render_template('forgotPassword.html', name=first_name+' '+last_name, callback=callback)
-        mail.send(msg)
+        queueEmails(template.renderBatch(recipients))
         return None
     except Exception as e:
         return e
@@ -0,0 +1,130 @@
+from backend import app, db
+from backend.models.coach_templates import Exercise, exercise_schemas, CatalogVersion
+from flask import json
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import threading
+import time
+
+CATALOG_NAME = 'exercises'
+
+# The serialized exercise catalog of this worker, stamped with the catalog version it was built from. The generation
+# changes whenever the cache is cleared, so a rebuild that started before the clear doesn't store its stale body
+_catalog = {
+    "version": None,
+    "body": None,
+    "checked_at": 0,
+    "generation": 0
+}
+_catalog_stats = {
+    "hits": 0,
+    "rebuilds": 0
+}
+_catalog_lock = threading.Lock()
+
+def catalogVersion():
+    """
+    Returns the current version of the exercise catalog in the db, 0 before the first write
+    """
+    version = db.session.query(CatalogVersion.version).filter_by(name=CATALOG_NAME).scalar()
+    return version if version != None else 0
+
+def bumpCatalogVersion():
+    """
+    Increments the catalog version in the current transaction, called before committing any write to the Exercises
+    table. The cache of this worker is dropped once the transaction commits so the next read rebuilds it, other workers
+    notice the new version on their next check. The version row stays locked until the transaction ends, so concurrent
+    writes get consecutive versions
+    Returns:
+        - the new version, stamped on the exercises written in the transaction
+    """
+    bumped = CatalogVersion.query.filter_by(name=CATALOG_NAME).update(
+        {'version': CatalogVersion.version + 1}, synchronize_session=False
+    )
+    if bumped == 0:
+        # First write to the catalog, another worker creating the row at the same time makes the insert fail
+        try:
+            with db.session.begin_nested():
+                db.session.add(CatalogVersion(name=CATALOG_NAME, version=1))
+        except IntegrityError:
+            CatalogVersion.query.filter_by(name=CATALOG_NAME).update(
+                {'version': CatalogVersion.version + 1}, synchronize_session=False
+            )
+    # Clearing now would let a read in this worker rebuild the cache from the catalog still committed
+    db.session.info['catalog_changed'] = True
+    return catalogVersion()
+
+@event.listens_for(Session, 'after_commit')
+def _clearCatalogCacheOnCommit(session):
+    if session.info.pop('catalog_changed', False):
+        clearCatalogCache()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forgetCatalogChange(session, previous_transaction):
+    session.info.pop('catalog_changed', None)
+
+def getCatalog():
+    """
+    Returns the serialized exercise catalog. Warm reads are served from memory, the catalog version is only read from
+    the db every EXERCISE_CATALOG_CHECK_INTERVAL seconds and the catalog is only queried again when it changed
+    Returns:
+        - the catalog version
+        - the {"exercises": [...], "version": version} response body as json
+    """
+    now = time.time()
+    with _catalog_lock:
+        if _catalog["body"] != None and now - _catalog["checked_at"] < app.config["EXERCISE_CATALOG_CHECK_INTERVAL"]:
+            _catalog_stats["hits"] += 1
+            return _catalog["version"], _catalog["body"]
+        generation = _catalog["generation"]
+
+    version = catalogVersion()
+    with _catalog_lock:
+        if _catalog["body"] != None and _catalog["version"] == version:
+            _catalog["checked_at"] = now
+            _catalog_stats["hits"] += 1
+            return version, _catalog["body"]
+
+    body = json.dumps({
+        "exercises": exercise_schemas.dump(Exercise.query.order_by(Exercise.id).all()),
+        "version": version
+    })
+    with _catalog_lock:
+        if _catalog["generation"] == generation:
+            _catalog["version"] = version
+            _catalog["body"] = body
+            _catalog["checked_at"] = now
+        _catalog_stats["rebuilds"] += 1
+    return version, body
+
+def catalogChanges(since):
+    """
+    Returns the exercises added or changed after a catalog version, ordered by id
+    """
+    return Exercise.query.filter(Exercise.version > since).order_by(Exercise.id).all()
+
+def catalogETag(version):
+    """
+    Returns the ETag of a catalog version, the catalog only changes together with its version
+    """
+    return 'exercises-' + str(version)
+
+def clearCatalogCache():
+    """
+    Drops the cached catalog of this worker
+    """
+    with _catalog_lock:
+        _catalog["version"] = None
+        _catalog["body"] = None
+        _catalog["checked_at"] = 0
+        _catalog["generation"] += 1
+
+def catalogStats():
+    """
+    Returns the cached catalog version and the number of reads served from the cache and of rebuilds
+    """
+    with _catalog_lock:
+        stats = dict(_catalog_stats)
+        stats["version"] = _catalog["version"]
+    return stats
@@ -0,0 +1,196 @@
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import requests
+import os
+import random
+import uuid
+import threading
+import time
+
+# Methods that are safe to send again when the response was lost
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+# Statuses that mean the upstream rejected the request without processing it, so any method can be retried. Other
+# server errors (including 502 and 504 from a proxy that may have forwarded the request) only retry IDEMPOTENT_METHODS
+RETRY_STATUSES = (429, 503)
+
+def connectionFailed(error):
+    """
+    Returns True if a requests exception was raised before the request reached the upstream
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if len(error.args) != 0 else None
+    return isinstance(reason, NewConnectionError)
+
+class MultipartBody(object):
+    """
+    multipart/form-data request body that streams a file from its current position instead of reading it into memory.
+    The body can be sent again on retries, every iteration seeks back to where the file started
+
+    :param fields: dictionary of form fields sent before the file.
+    :param file_field: name of the file field.
+    :param file: file object to send, it must be seekable.
+    :param chunk_size: bytes read from the file at a time.
+    """
+
+    def __init__(self, fields, file_field, file, chunk_size=64 * 1024):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+        self.file = file
+        self.chunk_size = chunk_size
+        self.start = file.tell()
+        file.seek(0, os.SEEK_END)
+        self.file_size = file.tell() - self.start
+        file.seek(self.start)
+
+        head = b''
+        for name, value in fields.items():
+            head += ('--' + boundary + '\r\nContent-Disposition: form-data; name="' + name + '"\r\n\r\n' + str(value) + '\r\n').encode()
+        head += ('--' + boundary + '\r\nContent-Disposition: form-data; name="' + file_field + '"; filename="' + file_field +
+            '"\r\nContent-Type: application/octet-stream\r\n\r\n').encode()
+        self.head = head
+        self.tail = ('\r\n--' + boundary + '--\r\n').encode()
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __iter__(self):
+        self.file.seek(self.start)
+        yield self.head
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self.tail
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the circuit breaker of an HttpClient is open
+    """
+    pass
+
+class CircuitBreaker(object):
+    """
+    Opens after threshold consecutive failures and stays open for cooldown seconds, after which a single trial request
+    is let through (half open). The trial closes the breaker again if it succeeds and reopens it if it fails
+
+    :param threshold: consecutive failures that open the breaker, 0 disables the breaker.
+    :param cooldown: seconds the breaker stays open.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns True if a request may be sent
+        """
+        if self.threshold <= 0:
+            return True
+        with self.lock:
+            if self.opened_at == None:
+                return True
+            if time.time() - self.opened_at < self.cooldown or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.threshold > 0 and (self.opened_at != None or self.failures >= self.threshold):
+                self.opened_at = time.time()
+
+    def state(self):
+        with self.lock:
+            if self.opened_at == None:
+                return 'closed'
+            if time.time() - self.opened_at < self.cooldown:
+                return 'open'
+            return 'half-open'
+
+class HttpClient(object):
+    """
+    Shared requests session with a bounded keep-alive connection pool, connect/read timeouts, retries with jittered
+    exponential backoff and a circuit breaker. Idempotent requests are retried on any failure and server error, non
+    idempotent ones only when the upstream can't have processed them (connection failures and RETRY_STATUSES). The session is created lazily in each worker process
+
+    :param name: name of the upstream, used in logs.
+    :param pool_size: maximum number of connections kept open to a host.
+    :param connect_timeout: seconds to wait for a connection.
+    :param read_timeout: seconds to wait for the response.
+    :param retries: number of times a failed request is retried.
+    :param backoff: base seconds between retries, doubled on each retry.
+    :param breaker_threshold: consecutive failures that open the circuit breaker.
+    :param breaker_cooldown: seconds the circuit breaker stays open.
+    """
+
+    def __init__(self, name, pool_size, connect_timeout, read_timeout, retries, backoff, breaker_threshold, breaker_cooldown):
+        self.name = name
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self._session = None
+        self._pid = None
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request through the pooled session, arguments are passed on to requests.Session.request
+        Returns:
+            - the requests.Response
+        Raises:
+            - CircuitOpenError if the circuit breaker is open
+            - requests.RequestException if the request still failed after the retries
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(self.name + " circuit breaker is open")
+
+            try:
+                resp = self._getSession().request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self.breaker.failure()
+                if attempt >= self.retries or not (connectionFailed(e) or method in IDEMPOTENT_METHODS):
+                    raise
+                print(self.name + " request failed, retrying: " + str(e))
+            else:
+                if resp.status_code < 500:
+                    self.breaker.success()
+                else:
+                    self.breaker.failure()
+                if attempt >= self.retries or not (resp.status_code in RETRY_STATUSES or (resp.status_code >= 500 and method in IDEMPOTENT_METHODS)):
+                    return resp
+                print(self.name + " request returned " + str(resp.status_code) + ", retrying")
+
+            # Full jitter keeps retries from many greenlets from arriving together
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def _getSession(self):
+        # Connections don't survive a fork, so gunicorn workers each create their own session on first use
+        if self._session == None or self._pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            self._pid = os.getpid()
+        return self._session
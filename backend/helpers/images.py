@@ -0,0 +1,109 @@
+from backend import app
+from backend.helpers.pools import WorkerPool
+from PIL import Image, ImageOps
+import io
+import threading
+
+# Decoding and re-encoding photos holds the GIL for long stretches, so it runs in worker processes
+_image_pool = WorkerPool('image-processing', app.config["IMAGE_POOL_SIZE"], processes=True)
+
+# Totals of all images prepared by this process
+_image_stats = {
+    "processed": 0,
+    "skipped": 0,
+    "bytes_in": 0,
+    "bytes_out": 0
+}
+_image_stats_lock = threading.Lock()
+
+def processImage(data, max_dimension, image_format, quality):
+    """
+    Downscales an image so neither side is longer than max_dimension and re-encodes it without its EXIF metadata.
+    The EXIF orientation is applied to the pixels first so photos keep their rotation. Runs in the image pool
+    Returns:
+        - the encoded image (bytes)
+    """
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    # thumbnail only ever shrinks and keeps the aspect ratio
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+def prepareImage(data):
+    """
+    Prepares a photo for upload: strips EXIF, caps its dimensions at IMAGE_MAX_DIMENSION and re-encodes it as
+    IMAGE_FORMAT at IMAGE_QUALITY. Images that can't be decoded are returned unchanged
+    Arguments:
+        - data (bytes): the photo as uploaded
+    Returns:
+        - the bytes to upload
+        - number of bytes saved, negative if re-encoding made the image bigger
+    """
+    if not app.config["IMAGE_PROCESSING"]:
+        return data, 0
+
+    try:
+        processed = _image_pool.run(
+            processImage, data, app.config["IMAGE_MAX_DIMENSION"], app.config["IMAGE_FORMAT"], app.config["IMAGE_QUALITY"]
+        )
+    except Exception as e:
+        print("Failed to process image, uploading it unchanged: " + str(e))
+        processed = None
+
+    # Processed images are used even when re-encoding made them bigger, so the EXIF data (e.g. location) is always stripped
+    if processed == None:
+        with _image_stats_lock:
+            _image_stats["skipped"] += 1
+        return data, 0
+
+    with _image_stats_lock:
+        _image_stats["processed"] += 1
+        _image_stats["bytes_in"] += len(data)
+        _image_stats["bytes_out"] += len(processed)
+    return processed, len(data) - len(processed)
+
+def prepareUpload(image):
+    """
+    Prepares an uploaded photo file for upload, see prepareImage. With IMAGE_PROCESSING off the file is returned as is so
+    it is streamed to imgur from where it was spooled, without being read into memory
+    Arguments:
+        - image (file): the photo as uploaded
+    Returns:
+        - file object to upload
+        - number of bytes saved
+    """
+    if not app.config["IMAGE_PROCESSING"]:
+        return image, 0
+    data, saved = prepareImage(image.read())
+    return io.BytesIO(data), saved
+
+def makeThumbnail(data):
+    """
+    Makes a thumbnail of a photo, no side is longer than THUMBNAIL_SIZE
+    Arguments:
+        - data (bytes): the photo
+    Returns:
+        - the thumbnail (bytes), or None if the photo can't be decoded
+    """
+    try:
+        return _image_pool.run(
+            processImage, data, app.config["THUMBNAIL_SIZE"], app.config["IMAGE_FORMAT"], app.config["THUMBNAIL_QUALITY"]
+        )
+    except Exception as e:
+        print("Failed to make thumbnail: " + str(e))
+        return None
+
+def imageStats():
+    """
+    Returns the number of images processed and skipped by this process and the bytes saved
+    """
+    with _image_stats_lock:
+        stats = dict(_image_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    stats["pool"] = _image_pool.stats()
+    return stats
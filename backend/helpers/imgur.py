@@ -1,10 +1,17 @@
-from requests import request
+from backend import app
+from backend.helpers.http_client import HttpClient, CircuitOpenError, MultipartBody
+import requests
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-ROOT_URL = 'https://imgur-apiv3.p.rapidapi.com/3'
+# Shared keep-alive connections to imgur, see helpers.http_client.HttpClient
+client = HttpClient(
+    'imgur', app.config["IMGUR_POOL_SIZE"], app.config["IMGUR_CONNECT_TIMEOUT"], app.config["IMGUR_READ_TIMEOUT"],
+    app.config["IMGUR_RETRIES"], app.config["IMGUR_RETRY_BACKOFF"], app.config["IMGUR_BREAKER_THRESHOLD"],
+    app.config["IMGUR_BREAKER_COOLDOWN"]
+)
 
 HEADERS = {
     'x-rapidapi-host': os.getenv('X_RAPIDAPI_HOST'),
@@ -12,12 +19,24 @@ HEADERS = {
     'Authorization': os.getenv('IMGUR_AUTH_HEADER')
 }
 
-ADD_IMAGE_HEADERS = {
-    'x-rapidapi-host': os.getenv('X_RAPIDAPI_HOST'),
-    'x-rapidapi-key': os.getenv('X_RAPIDAPI_KEY'),
-    'Authorization': os.getenv('IMGUR_AUTH_HEADER'),
-    'content-type': "application/x-www-form-urlencoded"
-}
+def request(method, path, **kwargs):
+    """
+    Sends a request to the imgur api through the shared client
+    Returns:
+        - the decoded json response, or a response with only a status when imgur couldn't be reached: 503 while
+          the circuit breaker is open, 504 on timeouts and 502 on other failures
+    """
+    try:
+        return client.request(method, app.config["IMGUR_ROOT_URL"] + path, **kwargs).json()
+    except CircuitOpenError as e:
+        print(e)
+        return {"status": 503}
+    except requests.Timeout as e:
+        print("Imgur request timed out: " + str(e))
+        return {"status": 504}
+    except (requests.RequestException, ValueError) as e:
+        print("Imgur request failed: " + str(e))
+        return {"status": 502}
 
 def createAlbum():
     """
@@ -27,31 +46,49 @@ def createAlbum():
         - album_deletehash
         - status code
     """
-    resp = request("POST", ROOT_URL + '/album', headers=HEADERS).json()
+    resp = request("POST", '/album', headers=HEADERS)
     
     if resp['status'] != 200:
         return None, None, resp['status']
 
     return resp['data']['id'], resp['data']['deletehash'],  resp['status']
 
+def deleteAlbum(album):
+    """
+    Deletes an anonymous album from imgur using its delete hash
+    Returns:
+        - status code
+    """
+    resp = request("DELETE", '/album/' + album, headers=HEADERS)
+
+    return resp['status']
 
 def addImage(album, image):
     """
-    Adds a client image to an anonymous album from imgur and returns the resulting link and status code
+    Adds a client image to an anonymous album from imgur and returns the resulting link, delete hash and status code.
+    The image is streamed from the file, it is never read into memory as a whole
     Returns:
         - image link
+        - image deletehash
         - status code
     """
+    body = MultipartBody({"album": album}, 'image', image)
+    headers = dict(HEADERS)
+    headers['content-type'] = body.content_type
 
-    image_data = image.read()
-    payload = {
-        "album": album,
-        "image": image_data
-    }
+    resp = request("POST", '/image', data=body, headers=headers)
 
-    resp = request("POST", ROOT_URL + '/image', data=payload, headers=ADD_IMAGE_HEADERS).json()
-    
     if resp['status'] != 200:
-        return None, resp['status']
+        return None, None, resp['status']
+
+    return resp['data']['link'], resp['data']['deletehash'], resp['status']
+
+def deleteImage(image):
+    """
+    Deletes an anonymous image from imgur using its delete hash
+    Returns:
+        - status code
+    """
+    resp = request("DELETE", '/image/' + image, headers=HEADERS)
 
-    return resp['data']['link'], resp['status']
+    return resp['status']
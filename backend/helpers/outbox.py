@@ -0,0 +1,127 @@
+from backend import db, mail
+from backend.models.outbox import OutboxEmail, OutboxStatus
+from backend.helpers.work_queue import WorkQueue, drainQueue
+from flask_mail import Message
+import datetime
+import threading
+
+# Set when an email is queued so the in-process dispatcher sends it without waiting for its next interval
+outbox_wakeup = threading.Event()
+
+outbox = WorkQueue(OutboxEmail, OutboxStatus, 'EMAIL_OUTBOX', 'outbox email')
+
+# Totals of all dispatches run by this process
+_outbox_stats = {
+    "runs": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0,
+    "last_run": None
+}
+_outbox_lock = threading.Lock()
+
+def queueEmail(msg):
+    """
+    Stores a message in the outbox, it is delivered by the outbox dispatcher
+    Arguments:
+        - msg (flask_mail.Message): message to send
+    Returns:
+        - the queued OutboxEmail
+    """
+    return queueEmails([msg])[0]
+
+def queueEmails(msgs):
+    """
+    Stores several messages in the outbox in a single commit
+    Arguments:
+        - msgs (list): flask_mail.Message objects to send
+    Returns:
+        - the queued OutboxEmails
+    """
+    emails = [
+        OutboxEmail(
+            subject=msg.subject,
+            sender=msg.sender,
+            recipients=','.join(msg.recipients),
+            body=msg.body,
+            html=msg.html
+        ) for msg in msgs
+    ]
+    db.session.add_all(emails)
+    db.session.commit()
+    outbox_wakeup.set()
+    return emails
+
+def dispatchOutbox(batch_size=None):
+    """
+    Sends a batch of due emails from the outbox over a single SMTP connection. Emails are claimed before sending so
+    several dispatchers can drain the same outbox, a failed email is retried with exponential backoff until it
+    reaches EMAIL_OUTBOX_MAX_ATTEMPTS
+    Arguments:
+        - batch_size (int): maximum number of emails sent, defaults to EMAIL_OUTBOX_BATCH_SIZE
+    Returns:
+        - dictionary with the number of emails sent, scheduled for a retry and given up on
+    """
+    result = {
+        "sent": 0,
+        "retried": 0,
+        "failed": 0
+    }
+
+    now = datetime.datetime.utcnow()
+    emails = outbox.claim(batch_size)
+    if len(emails) == 0:
+        return result
+
+    remaining = list(emails)
+    try:
+        with mail.connect() as conn:
+            while len(remaining) != 0:
+                email = remaining[0]
+                try:
+                    conn.send(Message(
+                        email.subject,
+                        sender=email.sender,
+                        recipients=email.recipients.split(','),
+                        body=email.body,
+                        html=email.html
+                    ))
+                    outbox.complete(email)
+                    email.status = OutboxStatus.SENT.name
+                    email.sent_at = datetime.datetime.utcnow()
+                    result["sent"] += 1
+                except Exception as e:
+                    result[outbox.fail(email, e)] += 1
+                remaining.pop(0)
+                db.session.commit()
+    except Exception as e:
+        # The connection couldn't be opened or was lost, everything left in the batch is retried later
+        print("Outbox dispatch failed: " + str(e))
+        for email in remaining:
+            result[outbox.fail(email, e)] += 1
+        db.session.commit()
+
+    with _outbox_lock:
+        _outbox_stats["runs"] += 1
+        _outbox_stats["sent"] += result["sent"]
+        _outbox_stats["retried"] += result["retried"]
+        _outbox_stats["failed"] += result["failed"]
+        _outbox_stats["last_run"] = now.isoformat()
+
+    print("Outbox sent " + str(result["sent"]) + " emails, " + str(result["retried"]) + " to retry, " + str(result["failed"]) + " failed")
+    return result
+
+def drainOutbox(batch_size=None):
+    """
+    Dispatches batches until no due emails are left, used by the periodic outbox task and `flask dispatch-emails`
+    Returns:
+        - the number of emails sent
+    """
+    return drainQueue(dispatchOutbox, "sent", batch_size)
+
+def outboxStats():
+    """
+    Returns the number of dispatches run by this process and the emails they sent, retried and gave up on
+    """
+    with _outbox_lock:
+        return dict(_outbox_stats)
@@ -0,0 +1,82 @@
+from backend import app, bcrypt
+from backend.helpers.pools import WorkerPool
+import time
+
+# bcrypt is CPU bound and would stall every greenlet in the worker, so hashing runs on a bounded pool of native threads
+_password_pool = WorkerPool('password-hashing', app.config["PASSWORD_HASH_POOL_SIZE"])
+
+def hashPassword(password):
+    """
+    Hashes a password with bcrypt on the password pool, using the BCRYPT_LOG_ROUNDS work factor
+    Arguments:
+        - password (string): plain text password
+    Returns:
+        - the bcrypt hash as a utf-8 string
+    """
+    return _password_pool.run(bcrypt.generate_password_hash, password, app.config["BCRYPT_LOG_ROUNDS"]).decode(encoding="utf-8")
+
+def checkPassword(pw_hash, password):
+    """
+    Checks a password against a bcrypt hash on the password pool
+    Arguments:
+        - pw_hash (string): stored bcrypt hash
+        - password (string): plain text password
+    Returns:
+        - True if the password matches the hash
+    """
+    return _password_pool.run(bcrypt.check_password_hash, pw_hash, password.encode(encoding='utf-8'))
+
+def needsRehash(pw_hash):
+    """
+    Checks whether a stored hash was made with a lower work factor than BCRYPT_LOG_ROUNDS. Hashes are only ever
+    upgraded, so workers briefly running with different factors during a rollout don't rehash each others passwords
+    Arguments:
+        - pw_hash (string): stored bcrypt hash, formatted as $2b$<rounds>$<salt and hash>
+    Returns:
+        - True if the password should be hashed again
+    """
+    try:
+        rounds = int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds < app.config["BCRYPT_LOG_ROUNDS"]
+
+def timeHash(rounds):
+    """
+    Returns the milliseconds one bcrypt hash with the given work factor takes on this machine
+    """
+    start = time.perf_counter()
+    bcrypt.generate_password_hash('calibration', rounds)
+    return (time.perf_counter() - start) * 1000
+
+def calibrateRounds(target_ms=None, min_rounds=None, max_rounds=None):
+    """
+    Finds the highest bcrypt work factor whose hash time stays within target_ms on this machine. Every extra round
+    doubles the hash time, so the search stops once doubling the last measurement would pass the target
+    Arguments:
+        - target_ms (int): target hash latency, defaults to BCRYPT_TARGET_MS
+        - min_rounds (int): lowest work factor returned even if it is slower than the target, defaults to BCRYPT_MIN_ROUNDS
+        - max_rounds (int): highest work factor tried, defaults to BCRYPT_MAX_ROUNDS
+    Returns:
+        - the work factor
+    """
+    if target_ms == None:
+        target_ms = app.config["BCRYPT_TARGET_MS"]
+    if min_rounds == None:
+        min_rounds = app.config["BCRYPT_MIN_ROUNDS"]
+    if max_rounds == None:
+        max_rounds = app.config["BCRYPT_MAX_ROUNDS"]
+
+    rounds = min_rounds
+    elapsed = timeHash(rounds)
+    while rounds < max_rounds and elapsed * 2 <= target_ms:
+        rounds += 1
+        elapsed = timeHash(rounds)
+    print("bcrypt calibration picked " + str(rounds) + " rounds (" + str(round(elapsed)) + "ms per hash, target " + str(target_ms) + "ms)")
+    return rounds
+
+def passwordPoolStats():
+    """
+    Returns the size, queue depth and totals of the password hashing pool
+    """
+    return _password_pool.stats()
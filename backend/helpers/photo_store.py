@@ -0,0 +1,176 @@
+from backend import app
+import backend.helpers.imgur as imgur
+from abc import ABC, abstractmethod
+from PIL import Image
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+
+# Names of the photos served by the local store, the sha256 of their content and an extension
+PHOTO_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+class PhotoStore(ABC):
+    """
+    Backend check in photos are stored in. Albums group the photos of a client, images are added to them and
+    identified by a delete hash that removes them again
+    """
+
+    @abstractmethod
+    def createAlbum(self):
+        """
+        Returns:
+            - album_id
+            - album_deletehash, used to add images to the album
+            - status code
+        """
+
+    @abstractmethod
+    def deleteAlbum(self, album):
+        """
+        Returns:
+            - status code
+        """
+
+    @abstractmethod
+    def addImage(self, album, image):
+        """
+        Returns:
+            - image link
+            - image deletehash
+            - status code
+        """
+
+    @abstractmethod
+    def deleteImage(self, image):
+        """
+        Returns:
+            - status code
+        """
+
+class ImgurStore(PhotoStore):
+    """
+    Stores photos in anonymous imgur albums, see helpers.imgur
+    """
+
+    def createAlbum(self):
+        return imgur.createAlbum()
+
+    def deleteAlbum(self, album):
+        return imgur.deleteAlbum(album)
+
+    def addImage(self, album, image):
+        return imgur.addImage(album, image)
+
+    def deleteImage(self, image):
+        return imgur.deleteImage(image)
+
+class LocalPhotoStore(PhotoStore):
+    """
+    Content-addressed photo store on the local filesystem. Photos are stored once under the sha256 of their content,
+    so the same photo added twice (or to several albums) takes the space of one, and served by the /photos route.
+    Stored photos never change, which lets clients cache them forever
+
+    :param root: directory the photos are stored in.
+    :param base_url: url the /photos route is reachable under, links are relative when empty.
+    """
+
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def createAlbum(self):
+        # Albums only exist in the users table, the photos themselves aren't grouped
+        album = uuid.uuid4().hex
+        return album, album, 200
+
+    def deleteAlbum(self, album):
+        return 200
+
+    def addImage(self, album, image):
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Hash the photo while streaming it to a temporary file, it is only moved into place once complete
+        digest = hashlib.sha256()
+        tmp = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        try:
+            with tmp:
+                while True:
+                    chunk = image.read(64 * 1024)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            name = digest.hexdigest() + '.' + self.extension(tmp.name)
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(tmp.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp.name, path)
+        except Exception:
+            # Don't leave the partial photo behind in tmp
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            raise
+
+        return self.base_url + '/photos/' + name, name, 200
+
+    def deleteImage(self, image):
+        # Photos are shared by every check in that uploaded the same content, so they are never removed
+        return 200
+
+    def extension(self, path):
+        """
+        Returns the extension of a photo from the format Pillow identifies, only the header is read. Files that aren't
+        images Pillow knows are stored as .bin
+        """
+        try:
+            with Image.open(path) as image:
+                return image.format.lower()
+        except Exception:
+            return 'bin'
+
+    def path(self, name):
+        """
+        Returns the path of a stored photo, photos are spread over directories named by the first two hash characters
+        """
+        return os.path.join(self.root, name[:2], name)
+
+_store = None
+
+def getStore():
+    """
+    Returns the photo store selected by app.config["PHOTO_STORE"], 'imgur' or 'local'
+    """
+    global _store
+    if _store == None:
+        if app.config["PHOTO_STORE"] == 'imgur':
+            _store = ImgurStore()
+        elif app.config["PHOTO_STORE"] == 'local':
+            _store = LocalPhotoStore(app.config["PHOTO_STORE_DIR"], app.config["PHOTO_STORE_URL"])
+        else:
+            raise ValueError("Unknown PHOTO_STORE " + str(app.config["PHOTO_STORE"]) + ", expected 'imgur' or 'local'")
+    return _store
+
+def resetStore():
+    """
+    Drops the photo store so the next call to getStore picks it again from the config
+    """
+    global _store
+    _store = None
+
+def createAlbum():
+    return getStore().createAlbum()
+
+def deleteAlbum(album):
+    return getStore().deleteAlbum(album)
+
+def addImage(album, image):
+    return getStore().addImage(album, image)
+
+def deleteImage(image):
+    return getStore().deleteImage(image)
@@ -0,0 +1,148 @@
+from backend import app, db
+from backend.models.client_templates import CheckIn, PhotoUpload, PhotoUploadStatus
+from backend.models.user import User
+from backend.helpers.albums import ensureAlbum, upload_pool
+from backend.helpers.photo_store import addImage
+from backend.helpers.images import prepareUpload, makeThumbnail
+from backend.helpers.work_queue import WorkQueue, drainQueue
+from sqlalchemy import func
+import datetime
+import io
+import os
+import threading
+import uuid
+
+# Set when photos are spooled so the in-process worker uploads them without waiting for its next interval
+photo_upload_wakeup = threading.Event()
+
+photo_queue = WorkQueue(PhotoUpload, PhotoUploadStatus, 'PHOTO_UPLOAD', 'photo upload')
+
+def spoolPhotos(checkin, user, images, links=None):
+    """
+    Saves check in photos to PHOTO_SPOOL_DIR and adds a pending PhotoUpload for each of them to the db session, the
+    uploads are stored when the caller commits. The spool is local to this PHOTO_SPOOL_HOST, only workers on the same
+    host (or sharing PHOTO_SPOOL_DIR under the same PHOTO_SPOOL_HOST) upload the photos
+    Arguments:
+        - checkin (CheckIn): check in the photos belong to
+        - user (User): client the photos belong to
+        - images (dict): image files keyed by check in field (front, back, side_a, side_b)
+        - links (dict): links of photos that were already uploaded keyed by field, only their thumbnails are uploaded
+    Returns:
+        - list of the PhotoUploads
+    """
+    spool_dir = app.config["PHOTO_SPOOL_DIR"]
+    os.makedirs(spool_dir, exist_ok=True)
+
+    uploads = []
+    for field, image in images.items():
+        path = os.path.join(spool_dir, str(uuid.uuid4()))
+        # the file may have been read already when it was uploaded
+        image.seek(0)
+        image.save(path)
+        link = links.get(field) if links != None else None
+        upload = PhotoUpload(
+            check_in_id=checkin.id, user_id=user.id, field=field, spool_host=app.config["PHOTO_SPOOL_HOST"], spool_path=path, link=link
+        )
+        db.session.add(upload)
+        uploads.append(upload)
+    return uploads
+
+def processPhotoUploads(batch_size=None):
+    """
+    Uploads a batch of spooled photos and their thumbnails concurrently and backfills their links into the check ins. Uploads are
+    claimed before uploading so several workers can share the table, a failed upload is retried with exponential
+    backoff until it reaches PHOTO_UPLOAD_MAX_ATTEMPTS. Only photos spooled on this PHOTO_SPOOL_HOST are claimed, the
+    spooled files of other hosts aren't reachable from here
+    Arguments:
+        - batch_size (int): maximum number of photos uploaded, defaults to PHOTO_UPLOAD_BATCH_SIZE
+    Returns:
+        - dictionary with the number of photos uploaded, scheduled for a retry and given up on
+    """
+    result = {
+        "uploaded": 0,
+        "retried": 0,
+        "failed": 0
+    }
+
+    uploads = photo_queue.claim(batch_size, (PhotoUpload.spool_host == app.config["PHOTO_SPOOL_HOST"],))
+    if len(uploads) == 0:
+        return result
+
+    # Every client's photos go to their own album, created on their first upload
+    albums = {}
+    for upload in uploads:
+        if upload.user_id not in albums:
+            albums[upload.user_id], code = ensureAlbum(User.query.get(upload.user_id))
+
+    ready = [upload for upload in uploads if albums[upload.user_id] != None]
+    for upload in uploads:
+        if albums[upload.user_id] == None:
+            result[photo_queue.fail(upload, "Failed to create photo album")] += 1
+    db.session.commit()
+
+    results = upload_pool.runAll(_uploadSpooled, [(albums[upload.user_id], upload.spool_path, upload.link) for upload in ready])
+    for upload, (uploaded, error) in zip(ready, results):
+        if error != None:
+            result[photo_queue.fail(upload, error)] += 1
+            db.session.commit()
+            continue
+
+        link, thumbnail, code = uploaded
+        # a photo uploaded before its thumbnail failed isn't uploaded again on the retry
+        upload.link = link
+        if code != 200:
+            result[photo_queue.fail(upload, "photo store returned " + str(code))] += 1
+        else:
+            _backfill(upload, thumbnail)
+            result["uploaded"] += 1
+        db.session.commit()
+
+    print("Photo uploads uploaded " + str(result["uploaded"]) + " photos, " + str(result["retried"]) + " to retry, " + str(result["failed"]) + " failed")
+    return result
+
+def drainPhotoUploads(batch_size=None):
+    """
+    Processes batches until no due photos are left, used by the periodic photo upload task and `flask upload-photos`.
+    Photos given up on keep their spooled file so they can still be recovered
+    Returns:
+        - the number of photos uploaded
+    """
+    return drainQueue(processPhotoUploads, "uploaded", batch_size)
+
+def _uploadSpooled(album, path, link):
+    with open(path, 'rb') as image:
+        if link == None:
+            upload, bytes_saved = prepareUpload(image)
+            link, deletehash, code = addImage(album, upload)
+            if code != 200:
+                return None, None, code
+
+        if not app.config["PHOTO_THUMBNAILS"]:
+            return link, None, 200
+        image.seek(0)
+        data = makeThumbnail(image.read())
+    if data == None:
+        # photos that can't be decoded are kept without a thumbnail
+        return link, None, 200
+
+    thumbnail, deletehash, code = addImage(album, io.BytesIO(data))
+    return link, thumbnail, code
+
+def _backfill(upload, thumbnail):
+    photo_queue.complete(upload)
+    upload.status = PhotoUploadStatus.DONE.name
+    upload.thumbnail = thumbnail
+    upload.uploaded_at = datetime.datetime.utcnow()
+
+    # A photo submitted later for the same field wins, even if this upload finished after it
+    latest = db.session.query(func.max(PhotoUpload.id)).filter_by(check_in_id=upload.check_in_id, field=upload.field).scalar()
+    if latest == upload.id:
+        checkin = CheckIn.query.get(upload.check_in_id)
+        if checkin != None:
+            setattr(checkin, upload.field, upload.link)
+            setattr(checkin, upload.field + '_thumbnail', thumbnail)
+
+    try:
+        os.remove(upload.spool_path)
+    except OSError as e:
+        print("Failed to remove spooled photo " + upload.spool_path + ": " + str(e))
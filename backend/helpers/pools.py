@@ -0,0 +1,161 @@
+from gevent import monkey
+import concurrent.futures
+import os
+import time
+
+# Counters are updated from the pool's native threads, so they need a real lock even when threading is monkeypatched
+_allocate_native_lock = monkey.get_original('_thread', 'allocate_lock')
+
+def geventPatched():
+    """
+    Returns True when running under the gevent worker (threading has been monkeypatched)
+    """
+    return monkey.is_module_patched('threading')
+
+def _runTimed(fn, args):
+    # Runs in the pool's worker process, the start time lets the parent measure how long the task was queued. Exceptions
+    # are returned rather than raised so failed tasks report their start too
+    started_at = time.time()
+    try:
+        return started_at, fn(*args), None
+    except Exception as e:
+        return started_at, None, e
+
+class WorkerPool(object):
+    """
+    Bounded pool of native threads for CPU-bound work such as password hashing. Under the gevent worker a gevent
+    ThreadPool is used so the calling greenlet yields to the hub while it waits, otherwise a concurrent.futures
+    ThreadPoolExecutor. The pool is created lazily in each worker process, a size of 0 runs tasks inline
+
+    :param name: name of the pool, used in stats and thread names.
+    :param size: maximum number of tasks running at the same time.
+    :param greenlets: run tasks as greenlets instead of native threads under the gevent worker, for I/O bound work
+                      such as http requests.
+    :param processes: run tasks in a ProcessPoolExecutor, for CPU bound work that holds the GIL. fn and its arguments
+                      must be picklable, and queue_depth includes the running tasks since their start isn't observed.
+    """
+
+    def __init__(self, name, size, greenlets=False, processes=False):
+        self.name = name
+        self.size = size
+        self.greenlets = greenlets
+        self.processes = processes
+        self._pool = None
+        self._pid = None
+        self._lock = _allocate_native_lock()
+        self._pool_lock = _allocate_native_lock()
+        self._submitted = 0
+        self._started = 0
+        self._completed = 0
+        self._peak_queue_depth = 0
+        self._queue_time = 0.0
+
+    def run(self, fn, *args):
+        """
+        Runs fn(*args) on the pool and waits for its result, exceptions raised by fn are re-raised in the caller
+        """
+        if self.size <= 0:
+            return fn(*args)
+        return self._wait(self._submit(fn, args))
+
+    def runAll(self, fn, args_list):
+        """
+        Runs fn(*args) for every tuple in args_list concurrently and waits for all of them
+        Returns:
+            - list of (result, exception) pairs in the order of args_list, exception is None when fn succeeded
+        """
+        if self.size <= 0:
+            calls = [lambda args=args: fn(*args) for args in args_list]
+        else:
+            handles = [self._submit(fn, args) for args in args_list]
+            calls = [lambda handle=handle: self._wait(handle) for handle in handles]
+
+        results = []
+        for call in calls:
+            try:
+                results.append((call(), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def _submit(self, fn, args):
+        pool = self._getPool()
+        queued_at = time.time()
+        with self._lock:
+            self._submitted += 1
+            self._peak_queue_depth = max(self._peak_queue_depth, self._submitted - self._started)
+
+        if self.processes:
+            return (pool.submit(_runTimed, fn, args), queued_at)
+
+        def task():
+            with self._lock:
+                self._started += 1
+                self._queue_time += time.time() - queued_at
+            return fn(*args)
+
+        if geventPatched():
+            return pool.spawn(task)
+        return pool.submit(task)
+
+    def _wait(self, handle):
+        try:
+            if self.processes:
+                # Under the gevent worker the future is resolved by a greenlet, so waiting on it yields to the hub
+                future, queued_at = handle
+                try:
+                    started_at, result, error = future.result()
+                except Exception:
+                    # The worker process died before reporting back, count the task as started so running stays consistent
+                    with self._lock:
+                        self._started += 1
+                    raise
+                with self._lock:
+                    self._started += 1
+                    self._queue_time += started_at - queued_at
+                if error != None:
+                    raise error
+                return result
+            if geventPatched():
+                return handle.get()
+            return handle.result()
+        finally:
+            with self._lock:
+                self._completed += 1
+
+    def stats(self):
+        """
+        Returns the pool size, the number of queued and running tasks and the totals since the pool was created
+        """
+        with self._lock:
+            started = self._started
+            return {
+                "name": self.name,
+                "size": self.size,
+                "queue_depth": self._submitted - started,
+                "running": started - self._completed,
+                "peak_queue_depth": self._peak_queue_depth,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "average_queue_ms": (self._queue_time / started * 1000) if started != 0 else 0
+            }
+
+    def _getPool(self):
+        # Pools don't survive a fork, so gunicorn workers each create their own on first use
+        if self._pool != None and self._pid == os.getpid():
+            return self._pool
+        with self._pool_lock:
+            if self._pool != None and self._pid == os.getpid():
+                return self._pool
+            if self.processes:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.size)
+            elif geventPatched() and self.greenlets:
+                from gevent.pool import Pool
+                self._pool = Pool(self.size)
+            elif geventPatched():
+                from gevent.threadpool import ThreadPool
+                self._pool = ThreadPool(self.size)
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=self.name)
+            self._pid = os.getpid()
+        return self._pool
@@ -0,0 +1,91 @@
+from backend import app, db
+from backend.models.user import User
+from itsdangerous import want_bytes
+from datetime import datetime
+import threading
+
+# Totals of all sweeps run by this process
+_sweep_stats = {
+    "runs": 0,
+    "expired": 0,
+    "orphaned": 0,
+    "last_run": None
+}
+_sweep_lock = threading.Lock()
+
+def sweepSessions(batch_size=None):
+    """
+    Deletes expired and orphaned rows from the Flask-Session sessions table in batches of batch_size rows. A session is
+    orphaned when the access_token stored in it no longer belongs to any user (logged out, renewed or deleted users)
+    Arguments:
+        - batch_size (int): rows deleted per statement, defaults to SESSION_SWEEP_BATCH_SIZE
+    Returns:
+        - dictionary with the number of expired and orphaned sessions deleted, or None if sessions aren't stored
+          in the db
+    """
+    interface = app.session_interface
+    if not hasattr(interface, 'sql_session_model'):
+        return None
+    if batch_size == None:
+        batch_size = app.config["SESSION_SWEEP_BATCH_SIZE"]
+
+    model = interface.sql_session_model
+    session_db = interface.db
+
+    # Expired sessions, in batches so a large backlog doesn't hold locks on the whole table
+    expired = 0
+    now = datetime.utcnow()
+    while True:
+        ids = [row.id for row in session_db.session.query(model.id).filter(model.expiry <= now).limit(batch_size)]
+        if len(ids) == 0:
+            break
+        expired += model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        session_db.session.commit()
+
+    # Orphaned sessions, walk the table in id order and check each batch of tokens against the users table
+    orphaned = 0
+    last_id = 0
+    while True:
+        rows = session_db.session.query(model.id, model.data).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if len(rows) == 0:
+            break
+        last_id = rows[-1].id
+
+        tokens = {}
+        for row in rows:
+            try:
+                data = interface.serializer.loads(want_bytes(row.data))
+                tokens[row.id] = data.get('access_token')
+            except Exception:
+                tokens[row.id] = None
+
+        live_tokens = [token for token in tokens.values() if token != None and token != ""]
+        owned_tokens = set()
+        if len(live_tokens) != 0:
+            owned_tokens = set(
+                token for (token,) in db.session.query(User.access_token).filter(User.access_token.in_(live_tokens))
+            )
+
+        orphan_ids = [id for id, token in tokens.items() if token not in owned_tokens]
+        if len(orphan_ids) != 0:
+            orphaned += model.query.filter(model.id.in_(orphan_ids)).delete(synchronize_session=False)
+            session_db.session.commit()
+
+    with _sweep_lock:
+        _sweep_stats["runs"] += 1
+        _sweep_stats["expired"] += expired
+        _sweep_stats["orphaned"] += orphaned
+        _sweep_stats["last_run"] = now.isoformat()
+
+    print("Session sweep deleted " + str(expired) + " expired and " + str(orphaned) + " orphaned sessions")
+    return {
+        "expired": expired,
+        "orphaned": orphaned
+    }
+
+def sweepStats():
+    """
+    Returns the number of sweeps run by this process and the total number of sessions they reclaimed
+    """
+    with _sweep_lock:
+        return dict(_sweep_stats)
@@ -0,0 +1,66 @@
+from backend import app, db
+import os
+import threading
+import time
+
+# pid of the process the background tasks were started in
+_started_pid = None
+
+def startPeriodicTask(name, interval, task, wakeup=None):
+    """
+    Runs a task every interval seconds in a daemon thread inside an app context. Under the gevent worker threads are
+    monkeypatched, so the task runs as a greenlet that yields while it sleeps or waits on the db
+    Arguments:
+        - name (string): name of the thread, used when logging failures
+        - interval (int): seconds to sleep between runs
+        - task (function): called without arguments on every run
+        - wakeup (threading.Event): optional event that runs the task early when set
+    Returns:
+        - the started thread
+    """
+    def run():
+        while True:
+            if wakeup != None:
+                wakeup.wait(interval)
+                wakeup.clear()
+            else:
+                time.sleep(interval)
+            with app.app_context():
+                try:
+                    task()
+                except Exception as e:
+                    print("Periodic task " + name + " failed: " + str(e))
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def startBackgroundTasks():
+    """
+    Starts the periodic tasks enabled in the config: the session sweeper, the email outbox dispatcher and the photo
+    upload worker. Called once per web server worker from gunicorn.conf.py, later calls in the same process do nothing
+    Returns:
+        - the names of the started tasks
+    """
+    global _started_pid
+    if _started_pid == os.getpid():
+        return []
+    _started_pid = os.getpid()
+
+    from backend.helpers.session_sweeper import sweepSessions
+    from backend.helpers.outbox import drainOutbox, outbox_wakeup
+    from backend.helpers.photo_uploads import drainPhotoUploads, photo_upload_wakeup
+
+    started = []
+    if app.config["SESSION_SWEEP_INTERVAL"] > 0:
+        startPeriodicTask('session-sweeper', app.config["SESSION_SWEEP_INTERVAL"], sweepSessions)
+        started.append('session-sweeper')
+    if app.config["EMAIL_OUTBOX_INTERVAL"] > 0:
+        startPeriodicTask('email-outbox', app.config["EMAIL_OUTBOX_INTERVAL"], drainOutbox, outbox_wakeup)
+        started.append('email-outbox')
+    if (app.config["PHOTO_UPLOAD_MODE"] == 'background' or app.config["PHOTO_THUMBNAILS"]) and app.config["PHOTO_UPLOAD_INTERVAL"] > 0:
+        startPeriodicTask('photo-uploads', app.config["PHOTO_UPLOAD_INTERVAL"], drainPhotoUploads, photo_upload_wakeup)
+        started.append('photo-uploads')
+    return started
@@ -0,0 +1,129 @@
+from backend import app
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+# In-process revocation state used when http_guard runs in the 'stateless' verification mode. Logging out revokes
+# a single token until it expires, resetting a password revokes every token issued to the user before the reset.
+# The state lives in the worker process, so each gunicorn worker keeps its own copy.
+_revoked_tokens = {}
+_revoked_users = {}
+_revocation_lock = threading.Lock()
+
+# Access tokens live for 2 hours, anything revoked longer ago than this can no longer verify anyway
+REVOCATION_WINDOW = 2 * 60 * 60
+
+def tokenDigest(token):
+    """
+    Returns a fixed size digest of an access token so that raw tokens are never used as dictionary keys
+    """
+    return hashlib.sha256(token.encode(encoding="utf-8")).hexdigest()
+
+def revokeToken(token, exp=None):
+    """
+    Revokes a single access token, e.g. on logout. The entry is kept until the token expires
+    Arguments:
+        - token (string): the access token to revoke
+        - exp (int): expiry of the token as a unix timestamp, defaults to now + REVOCATION_WINDOW
+    """
+    if token == None or token == "":
+        return
+
+    now = time.time()
+    if exp == None:
+        exp = now + REVOCATION_WINDOW
+
+    with _revocation_lock:
+        _pruneRevocations(now)
+        _revoked_tokens[tokenDigest(token)] = exp
+
+def revokeUserTokens(user_id):
+    """
+    Revokes every access token issued to a user up until now, e.g. on a password reset
+    """
+    now = time.time()
+    with _revocation_lock:
+        _pruneRevocations(now)
+        _revoked_users[user_id] = int(now)
+
+def isTokenRevoked(token, payload):
+    """
+    Checks a decoded token payload against the revocation map
+    Arguments:
+        - token (string): the raw access token
+        - payload (dict): the decoded payload of the token containing iat and sub
+    Returns:
+        - True if the token was revoked, False otherwise
+    """
+    if tokenDigest(token) in _revoked_tokens:
+        return True
+
+    revoked_at = _revoked_users.get(payload['sub']['id'])
+    if revoked_at != None and payload['iat'] < revoked_at:
+        return True
+
+    return False
+
+def _pruneRevocations(now):
+    # Drop revocations for tokens that have expired on their own. Must be called with _revocation_lock held
+    for digest in [digest for digest, exp in _revoked_tokens.items() if exp < now]:
+        del _revoked_tokens[digest]
+    for user_id in [user_id for user_id, revoked_at in _revoked_users.items() if revoked_at + REVOCATION_WINDOW < now]:
+        del _revoked_users[user_id]
+
+# Decoded claims of recently verified access tokens, keyed by token digest. Entries expire together with the
+# token so a cache hit never outlives the signature check it replaces
+_claims_cache = OrderedDict()
+_claims_cache_lock = threading.Lock()
+_claims_cache_stats = {
+    "hits": 0,
+    "misses": 0
+}
+
+def getCachedClaims(token):
+    """
+    Looks up the decoded payload of an access token in the claims cache
+    Returns:
+        - payload (dict) or None if the token isn't cached or has expired
+    """
+    digest = tokenDigest(token)
+    with _claims_cache_lock:
+        entry = _claims_cache.get(digest)
+        if entry == None or entry['exp'] <= time.time():
+            if entry != None:
+                del _claims_cache[digest]
+            _claims_cache_stats["misses"] += 1
+            return None
+
+        # Mark the entry as most recently used
+        _claims_cache.move_to_end(digest)
+        _claims_cache_stats["hits"] += 1
+        return entry
+
+def cacheClaims(token, payload):
+    """
+    Stores the decoded payload of a verified access token, evicting the least recently used entry when the
+    cache holds more than CLAIMS_CACHE_SIZE tokens
+    """
+    max_size = app.config["CLAIMS_CACHE_SIZE"]
+    if max_size <= 0:
+        return
+
+    digest = tokenDigest(token)
+    with _claims_cache_lock:
+        _claims_cache[digest] = payload
+        _claims_cache.move_to_end(digest)
+        while len(_claims_cache) > max_size:
+            _claims_cache.popitem(last=False)
+
+def claimsCacheStats():
+    """
+    Returns the hit and miss counters and the current size of the claims cache
+    """
+    with _claims_cache_lock:
+        return {
+            "hits": _claims_cache_stats["hits"],
+            "misses": _claims_cache_stats["misses"],
+            "size": len(_claims_cache)
+        }
@@ -0,0 +1,98 @@
+from backend import app, db
+from sqlalchemy import or_
+import datetime
+import uuid
+
+class WorkQueue(object):
+    """
+    Table of rows worked through in the background by several workers, such as the email outbox and the photo uploads.
+    Rows are claimed in batches under a lease so two workers don't process the same row, a claim lapses if its worker
+    dies, and a failed row is retried with exponential backoff until it reaches its maximum number of attempts. The
+    model needs status, attempts, last_error, next_attempt_at, claimed_by and locked_until columns, the settings are read
+    from <prefix>_BATCH_SIZE, <prefix>_LEASE, <prefix>_RETRY_BASE, <prefix>_RETRY_MAX and <prefix>_MAX_ATTEMPTS
+
+    :param model: model of the table.
+    :param statuses: status enum of the model, with PENDING and FAILED members.
+    :param prefix: prefix of the config keys, e.g. EMAIL_OUTBOX.
+    :param label: name of a row in logs, e.g. outbox email.
+    """
+
+    def __init__(self, model, statuses, prefix, label):
+        self.model = model
+        self.statuses = statuses
+        self.prefix = prefix
+        self.label = label
+
+    def claim(self, batch_size=None, filters=()):
+        """
+        Claims a batch of due rows for this worker and commits the claim, rows claimed by another worker in the
+        meantime are skipped
+        Arguments:
+            - batch_size (int): maximum number of rows claimed, defaults to <prefix>_BATCH_SIZE
+            - filters (tuple): extra filters the claimed rows have to match
+        Returns:
+            - the claimed rows ordered by id
+        """
+        if batch_size == None:
+            batch_size = app.config[self.prefix + "_BATCH_SIZE"]
+        model = self.model
+
+        now = datetime.datetime.utcnow()
+        claimable = or_(model.locked_until == None, model.locked_until < now)
+        ids = [id for (id,) in db.session.query(model.id).filter(
+            model.status == self.statuses.PENDING.name, model.next_attempt_at <= now, claimable, *filters
+        ).order_by(model.id).limit(batch_size)]
+        if len(ids) == 0:
+            return []
+
+        claim = str(uuid.uuid4())
+        model.query.filter(model.id.in_(ids), claimable).update({
+            'claimed_by': claim,
+            'locked_until': now + datetime.timedelta(seconds=app.config[self.prefix + "_LEASE"])
+        }, synchronize_session=False)
+        db.session.commit()
+        return model.query.filter_by(claimed_by=claim).order_by(model.id).all()
+
+    def complete(self, row):
+        """
+        Counts the attempt of a processed row and releases its claim, the caller sets its final status
+        """
+        row.attempts += 1
+        row.claimed_by = None
+        row.locked_until = None
+
+    def fail(self, row, error):
+        """
+        Counts a failed attempt and releases the claim of a row, it is retried after a backoff of <prefix>_RETRY_BASE
+        seconds doubling up to <prefix>_RETRY_MAX, or marked FAILED once it reaches <prefix>_MAX_ATTEMPTS attempts
+        Returns:
+            - "retried" or "failed"
+        """
+        self.complete(row)
+        row.last_error = str(error)[:500]
+        if row.attempts >= app.config[self.prefix + "_MAX_ATTEMPTS"]:
+            row.status = self.statuses.FAILED.name
+            print("Giving up on " + self.label + " " + str(row.id) + " after " + str(row.attempts) + " attempts: " + row.last_error)
+            return "failed"
+
+        delay = min(app.config[self.prefix + "_RETRY_BASE"] * 2 ** (row.attempts - 1), app.config[self.prefix + "_RETRY_MAX"])
+        row.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+        return "retried"
+
+def drainQueue(process, done, batch_size=None):
+    """
+    Processes batches until one finds no due rows, used by the periodic tasks and the CLI commands
+    Arguments:
+        - process (function): processes one batch, called with batch_size and returning the number of rows that were
+          done, retried and failed
+        - done (string): key of the result holding the rows that were done
+        - batch_size (int): passed on to process
+    Returns:
+        - the number of rows done over all batches
+    """
+    total = 0
+    while True:
+        result = process(batch_size)
+        if result[done] + result["retried"] + result["failed"] == 0:
+            return total
+        total += result[done]
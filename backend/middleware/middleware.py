@@ -1,7 +1,20 @@
 from flask import session
 from functools import wraps
 from backend.models.user import User
-from backend import db
+from backend.helpers.tokens import isTokenRevoked, tokenDigest
+from backend import db, app
+import datetime
+import threading
+
+# Renewals of expired tokens currently in flight in this worker, keyed by the digest of the expired token. Concurrent
+# requests carrying the same expired token wait on the first renewal instead of minting tokens of their own
+_renewals = {}
+_renewals_lock = threading.Lock()
+
+# Seconds a request waits on a renewal in flight before renewing on its own
+RENEWAL_WAIT_TIMEOUT = 5
+# Seconds after a renewal in which requests sent with the old cookie are switched over to the new token, in any worker
+RENEWAL_GRACE_PERIOD = 30
 
 def http_guard(renew=True, nullable=False):
     """Checks for the presence and validity of the access token. It also handles renewing the access_token
@@ -33,9 +46,22 @@ def http_guard(renew=True, nullable=False):
                     "error": "Unauthorized. User is not logged in"
                 }, 401
 
+            # In stateless mode the token is verified locally and the db is only touched to renew it
+            if app.config["AUTH_VERIFICATION_MODE"] == 'stateless':
+                token_claims, error = verifyTokenStateless(token, renew)
+                if error != None:
+                    return error
+                return f(token_claims)
+
             # Check that there is a user who owns the access_token. Return unauthorized
             # if nullable is False
             user = User.query.filter_by(access_token=token).first()
+            if user == None:
+                # The token may have just been renewed by a concurrent request, switch over to its replacement
+                user, renewed = findRenewal(token)
+                if renewed != None:
+                    token = renewed
+                    session['access_token'] = token
             if user == None:
                 return {
                     "error": "Unauthorized. Invalid access token"
@@ -44,19 +70,184 @@ def http_guard(renew=True, nullable=False):
             # Check that the token is expired or not. Renew it if renew is True
             payload = user.decode_auth_token(user.access_token)
             if payload == 'Expired' and renew == True:
-                token = user.encode_auth_token({
-                    'id': user.id,
-                    'role': user.role
-                })
-
-                # Update the users access_token in the db
-                user.access_token = token
-                db.session.commit()
+                token = renewToken(user, token)
+                if token == None:
+                    return {
+                        "error": "Unauthorized. Invalid access token"
+                    }, 401
+                payload = user.decode_auth_token(token)
 
-                # Set the session access_token cookie
-                session['access_token'] = token
-
-            result = f(user.decode_auth_token(token))
+            result = f(payload)
             return result
         return __http_guard
     return _http_guard
+
+def verifyTokenStateless(token, renew):
+    """
+    Verifies the signature and expiry of an access token without querying the users table, revoked tokens
+    are rejected through the in-process revocation map. Expired tokens are renewed against the db if renew is True.
+    Missing tokens only reach this point for nullable endpoints, which are called without claims
+    Returns:
+        - token claims (dict) or None
+        - error response or None
+    """
+    if token == None or token == "":
+        return None, None
+
+    payload = User.decode_auth_payload(token)
+    if payload == 'Invalid':
+        return None, ({
+            "error": "Unauthorized. Invalid access token"
+        }, 401)
+
+    if payload != 'Expired':
+        if isTokenRevoked(token, payload):
+            return None, ({
+                "error": "Unauthorized. Invalid access token"
+            }, 401)
+        return payload['sub'], None
+
+    if renew == False:
+        return None, ({
+            "error": "Unauthorized. Access token expired"
+        }, 401)
+
+    # The token is expired, the user still has to own it for it to be renewed
+    payload = User.decode_auth_payload(token, verify_exp=False)
+    if isTokenRevoked(token, payload):
+        return None, ({
+            "error": "Unauthorized. Invalid access token"
+        }, 401)
+    user = User.query.get(payload['sub']['id'])
+    if user != None and user.access_token != token:
+        # The token may have just been renewed by a concurrent request, reuse its replacement
+        user, renewed = findRenewal(token, user)
+        if renewed != None:
+            session['access_token'] = renewed
+            return User.decode_auth_token(renewed), None
+    if user == None:
+        return None, ({
+            "error": "Unauthorized. Invalid access token"
+        }, 401)
+
+    token = renewToken(user, token)
+    if token == None:
+        return None, ({
+            "error": "Unauthorized. Invalid access token"
+        }, 401)
+    return User.decode_auth_token(token), None
+
+def renewToken(user, expired_token):
+    """
+    Renews an expired access token and sets the new token in the session. Renewals are single-flight: within a worker
+    only the first request carrying an expired token mints a replacement, concurrent requests wait for and reuse it.
+    Across workers the new token is only written if the user still owns the expired one (compare-and-swap), otherwise
+    the token written by the other worker is reused
+    Returns:
+        - the new access token or None if the user no longer owns the expired token
+    """
+    key = tokenDigest(expired_token)
+    with _renewals_lock:
+        renewal = _renewals.get(key)
+        leader = renewal == None
+        if leader:
+            renewal = {
+                "done": threading.Event(),
+                "token": None
+            }
+            _renewals[key] = renewal
+
+    if leader:
+        try:
+            renewal['token'] = swapAccessToken(user, expired_token)
+        finally:
+            with _renewals_lock:
+                del _renewals[key]
+            renewal['done'].set()
+        token = renewal['token']
+    else:
+        renewal['done'].wait(RENEWAL_WAIT_TIMEOUT)
+        token = renewal['token']
+        # The renewal in flight failed or took too long, renew on our own. The compare-and-swap keeps this safe
+        if token == None:
+            token = swapAccessToken(user, expired_token)
+
+    if token != None:
+        # Set the session access_token cookie
+        session['access_token'] = token
+
+    return token
+
+def swapAccessToken(user, expired_token):
+    """
+    Mints a new access token and stores it in the db, but only if the users current access_token is still the expired one.
+    The expired token is kept as the previous_access_token so requests still sending it find the renewal
+    Returns:
+        - the new access token, the token another worker renewed to, or None if the user has logged out since
+    """
+    token = user.encode_auth_token({
+        'id': user.id,
+        'role': user.role
+    })
+
+    # Update the users access_token in the db
+    swapped = User.query.filter_by(id=user.id, access_token=expired_token).update({
+        'access_token': token,
+        'previous_access_token': expired_token,
+        'renewed_at': datetime.datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    if swapped == 1:
+        return token
+
+    # Another worker renewed the token first, reuse its token if it is still valid
+    current_token = db.session.query(User.access_token).filter_by(id=user.id).scalar()
+    if current_token == None or current_token == "" or User.decode_auth_payload(current_token) in ('Expired', 'Invalid'):
+        return None
+    return current_token
+
+def findRenewal(expired_token, user=None):
+    """
+    Finds the replacement of an expired token renewed by a concurrent request. A renewal still in flight in this worker
+    is waited on, renewals committed by any worker within the last RENEWAL_GRACE_PERIOD seconds are found through the
+    previous_access_token they left on the user
+    Arguments:
+        - expired_token (string): access token sent with the request
+        - user (User): owner of the token when it is already loaded, otherwise the user is looked up by previous_access_token
+    Returns:
+        - the user and its new access token, or None, None if the token wasn't renewed
+    """
+    if expired_token == None or expired_token == "":
+        return None, None
+
+    renewed = awaitRenewal(expired_token)
+    if renewed != None:
+        # The user may have logged out since the renewal
+        owner = User.query.filter_by(access_token=renewed).first()
+        if owner == None or (user != None and owner.id != user.id):
+            return None, None
+        return owner, renewed
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=RENEWAL_GRACE_PERIOD)
+    if user == None:
+        user = User.query.filter(User.previous_access_token == expired_token, User.renewed_at >= cutoff).first()
+    elif user.previous_access_token != expired_token or user.renewed_at == None or user.renewed_at < cutoff:
+        user = None
+    # Users who logged out since have no access token to switch to
+    if user == None or user.access_token == None or user.access_token == "":
+        return None, None
+    return user, user.access_token
+
+def awaitRenewal(expired_token):
+    """
+    Waits for a renewal of an expired token still in flight in this worker
+    Returns:
+        - the new access token, or None if no renewal of the token is in flight or it failed
+    """
+    key = tokenDigest(expired_token)
+    with _renewals_lock:
+        renewal = _renewals.get(key)
+    if renewal == None:
+        return None
+    renewal['done'].wait(RENEWAL_WAIT_TIMEOUT)
+    return renewal['token']
@@ -0,0 +1,210 @@
+from flask.sessions import SecureCookieSessionInterface
+from flask_session import Session
+from flask_session.sessions import SessionInterface, ServerSideSession, SqlAlchemySessionInterface
+from itsdangerous import BadSignature, want_bytes
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+
+# Session backends that can be selected through SESSION_BACKEND
+SESSION_BACKENDS = ('sqlalchemy', 'cookie', 'memory', 'filesystem')
+
+def configureSessions(app):
+    """
+    Installs the session interface selected by app.config["SESSION_BACKEND"]
+        - sqlalchemy: sessions are stored in the sessions table (Flask-Session)
+        - cookie: the session is kept in a signed cookie, nothing is stored on the server
+        - memory: sessions are kept in an in-process LRU, only suitable for a single dyno/worker
+        - filesystem: sessions are stored as files in SESSION_FILE_DIR (Flask-Session)
+    """
+    backend = app.config["SESSION_BACKEND"]
+    refresh_threshold = timedelta(seconds=app.config["SESSION_REFRESH_THRESHOLD"])
+    if backend == 'sqlalchemy':
+        app.config["SESSION_TYPE"] = backend
+        app.session_interface = LazySqlAlchemySessionInterface(
+            app, app.config.get("SESSION_SQLALCHEMY"), app.config.get("SESSION_SQLALCHEMY_TABLE", 'sessions'),
+            app.config.get("SESSION_KEY_PREFIX", 'session:'), app.config.get("SESSION_USE_SIGNER", False),
+            app.config.get("SESSION_PERMANENT", True), refresh_threshold
+        )
+    elif backend == 'filesystem':
+        app.config["SESSION_TYPE"] = backend
+        Session(app)
+    elif backend == 'cookie':
+        app.session_interface = PermanentCookieSessionInterface()
+    elif backend == 'memory':
+        app.session_interface = MemorySessionInterface(
+            app.config["SESSION_MEMORY_SIZE"], app.config.get("SESSION_KEY_PREFIX", 'session:'),
+            app.config.get("SESSION_USE_SIGNER", False), app.config.get("SESSION_PERMANENT", True), refresh_threshold
+        )
+    else:
+        raise ValueError("Unknown SESSION_BACKEND " + str(backend) + ", expected one of " + ", ".join(SESSION_BACKENDS))
+
+class LazySaveMixin(object):
+    """
+    Skips saving sessions that weren't modified during the request. An unmodified session is only written again
+    once its expiry would move by more than refresh_threshold, which keeps sliding expiry without a write per request.
+    Interfaces using the mixin set session.stored_expiry to the expiry read from the store in open_session
+    """
+
+    refresh_threshold = timedelta(0)
+
+    def should_save_session(self, app, session):
+        if session.modified:
+            return True
+
+        stored_expiry = getattr(session, 'stored_expiry', None)
+        if stored_expiry == None:
+            return bool(session)
+        expires = self.get_expiration_time(app, session)
+        if expires == None:
+            return False
+        return expires - stored_expiry > self.refresh_threshold
+
+class LazySqlAlchemySessionInterface(LazySaveMixin, SqlAlchemySessionInterface):
+    """
+    Flask-Session's SQLAlchemy session interface that only writes to the sessions table when the session changed
+    or its expiry needs extending past the refresh threshold
+
+    :param refresh_threshold: timedelta an unmodified session's expiry may lag behind before it is rewritten.
+    """
+
+    def __init__(self, app, db, table, key_prefix, use_signer=False, permanent=True, refresh_threshold=timedelta(0)):
+        super(LazySqlAlchemySessionInterface, self).__init__(app, db, table, key_prefix, use_signer, permanent)
+        self.refresh_threshold = refresh_threshold
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid:
+            sid = self._generate_sid()
+            return self.session_class(sid=sid, permanent=self.permanent)
+        if self.use_signer:
+            signer = self._get_signer(app)
+            if signer is None:
+                return None
+            try:
+                sid_as_bytes = signer.unsign(sid)
+                sid = sid_as_bytes.decode()
+            except BadSignature:
+                sid = self._generate_sid()
+                return self.session_class(sid=sid, permanent=self.permanent)
+
+        store_id = self.key_prefix + sid
+        saved_session = self.sql_session_model.query.filter_by(
+            session_id=store_id).first()
+        if saved_session and saved_session.expiry <= datetime.utcnow():
+            # Delete expired session
+            self.db.session.delete(saved_session)
+            self.db.session.commit()
+            saved_session = None
+        if saved_session:
+            try:
+                val = saved_session.data
+                data = self.serializer.loads(want_bytes(val))
+                session = self.session_class(data, sid=sid)
+                session.stored_expiry = saved_session.expiry
+                return session
+            except:
+                return self.session_class(sid=sid, permanent=self.permanent)
+        return self.session_class(sid=sid, permanent=self.permanent)
+
+    def save_session(self, app, session, response):
+        if not self.should_save_session(app, session):
+            return
+        return super(LazySqlAlchemySessionInterface, self).save_session(app, session, response)
+
+class PermanentCookieSessionInterface(SecureCookieSessionInterface):
+    """
+    Flask's signed cookie session, made permanent like the server-side sessions so the cookie survives
+    browser restarts and expires after PERMANENT_SESSION_LIFETIME
+    """
+
+    def save_session(self, app, session, response):
+        if session and not session.permanent and app.config.get("SESSION_PERMANENT", True):
+            session.permanent = True
+        return super(PermanentCookieSessionInterface, self).save_session(app, session, response)
+
+class MemorySessionInterface(LazySaveMixin, SessionInterface):
+    """
+    Keeps sessions in a bounded in-process LRU. Sessions are lost on restart and are not shared between
+    workers, so this is only meant for single dyno deployments
+
+    :param max_size: Maximum number of sessions kept, the least recently used session is evicted first.
+    :param key_prefix: A prefix that is added to all store keys.
+    :param use_signer: Whether to sign the session id cookie or not.
+    :param permanent: Whether to use permanent session or not.
+    :param refresh_threshold: timedelta an unmodified session's expiry may lag behind before it is rewritten.
+    """
+
+    session_class = ServerSideSession
+
+    def __init__(self, max_size, key_prefix, use_signer=False, permanent=True, refresh_threshold=timedelta(0)):
+        self.max_size = max_size
+        self.refresh_threshold = refresh_threshold
+        self.key_prefix = key_prefix
+        self.use_signer = use_signer
+        self.permanent = permanent
+        self.store = OrderedDict()
+        self.lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid:
+            sid = self._generate_sid()
+            return self.session_class(sid=sid, permanent=self.permanent)
+        if self.use_signer:
+            signer = self._get_signer(app)
+            if signer is None:
+                return None
+            try:
+                sid_as_bytes = signer.unsign(sid)
+                sid = sid_as_bytes.decode()
+            except BadSignature:
+                sid = self._generate_sid()
+                return self.session_class(sid=sid, permanent=self.permanent)
+
+        store_id = self.key_prefix + sid
+        with self.lock:
+            saved_session = self.store.get(store_id)
+            if saved_session != None and saved_session[1] != None and saved_session[1] <= datetime.utcnow():
+                # Delete expired session
+                del self.store[store_id]
+                saved_session = None
+            if saved_session != None:
+                self.store.move_to_end(store_id)
+
+        if saved_session != None:
+            session = self.session_class(dict(saved_session[0]), sid=sid)
+            session.stored_expiry = saved_session[1]
+            return session
+        return self.session_class(sid=sid, permanent=self.permanent)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        store_id = self.key_prefix + session.sid
+        if not session:
+            if session.modified:
+                with self.lock:
+                    self.store.pop(store_id, None)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        if not self.should_save_session(app, session):
+            return
+
+        httponly = self.get_cookie_httponly(app)
+        secure = self.get_cookie_secure(app)
+        expires = self.get_expiration_time(app, session)
+        with self.lock:
+            self.store[store_id] = (dict(session), expires)
+            self.store.move_to_end(store_id)
+            while len(self.store) > self.max_size:
+                self.store.popitem(last=False)
+
+        if self.use_signer:
+            session_id = self._get_signer(app).sign(want_bytes(session.sid))
+        else:
+            session_id = session.sid
+        response.set_cookie(app.session_cookie_name, session_id,
+                            expires=expires, httponly=httponly,
+                            domain=domain, path=path, secure=secure)
@@ -0,0 +1,70 @@
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+import tempfile
+
+def configureUploads(app):
+    """
+    Installs the streaming request class and the upload size limits
+        - UPLOAD_MAX_TOTAL_SIZE: requests with a larger Content-Length are rejected before their body is read
+        - UPLOAD_MAX_PART_SIZE: a file part or form field growing past this size aborts the request while it streams
+        - UPLOAD_SPOOL_THRESHOLD: file parts larger than this are spooled to a temporary file instead of kept in memory
+    Oversized requests are answered with a 413 error
+    """
+    app.config["MAX_CONTENT_LENGTH"] = app.config["UPLOAD_MAX_TOTAL_SIZE"]
+    SpoolingRequest.max_form_memory_size = app.config["UPLOAD_MAX_PART_SIZE"]
+    SpoolingRequest.max_part_size = app.config["UPLOAD_MAX_PART_SIZE"]
+    SpoolingRequest.spool_threshold = app.config["UPLOAD_SPOOL_THRESHOLD"]
+    app.request_class = SpoolingRequest
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def requestEntityTooLarge(e):
+        return {
+            "error": "Request too large, files can be at most " + str(app.config["UPLOAD_MAX_PART_SIZE"]) +
+                " bytes and requests at most " + str(app.config["UPLOAD_MAX_TOTAL_SIZE"]) + " bytes"
+        }, 413
+
+class LimitedSpooledFile(object):
+    """
+    Stream a multipart file part is written to as it is parsed. Data is kept in memory until it grows past spool_threshold
+    and then moved to a temporary file, writing past max_size raises RequestEntityTooLarge so an oversized part is never
+    buffered in full. Reads, seeks etc. are passed on to the underlying SpooledTemporaryFile
+    """
+
+    def __init__(self, spool_threshold, max_size):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_threshold, mode='wb+')
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size != None and self.size > self.max_size:
+            self._file.close()
+            raise RequestEntityTooLarge()
+        return self._file.write(data)
+
+    @property
+    def spooled(self):
+        """
+        True if the part was moved to a temporary file
+        """
+        return self._file._rolled
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+class SpoolingRequest(Request):
+    """
+    Request that streams multipart file parts into LimitedSpooledFiles, configured by configureUploads
+    """
+
+    max_part_size = None
+    spool_threshold = 512 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Parts that declare their own size are rejected before any of their data is read
+        if self.max_part_size != None and content_length != None and content_length > self.max_part_size:
+            raise RequestEntityTooLarge()
+        return LimitedSpooledFile(self.spool_threshold, self.max_part_size)
@@ -1,5 +1,8 @@
 from backend import db, app, ma
 from backend.models.coach_templates import Exercise
+from marshmallow import post_dump
+from enum import Enum
+import datetime
 
 # Training_entries table
 class TrainingEntry(db.Model):
@@ -138,12 +141,76 @@ class CheckIn(db.Model):
     side_a = db.Column(db.String, nullable=True)
     side_b = db.Column(db.String, nullable=True)
     coach_viewed = db.Column(db.Boolean, nullable=False)
+    # thumbnails of the photos, backfilled by the photo upload worker
+    front_thumbnail = db.Column(db.String, nullable=True)
+    back_thumbnail = db.Column(db.String, nullable=True)
+    side_a_thumbnail = db.Column(db.String, nullable=True)
+    side_b_thumbnail = db.Column(db.String, nullable=True)
 
-
+# Check in photo fields, each has a <field>_thumbnail column
+PHOTO_FIELDS = ('front', 'back', 'side_a', 'side_b')
 
 class CheckInSchema(ma.Schema):
+    """
+    Photos are dumped as their thumbnails, or as the original photos when the schema is created with originals=True.
+    Photos without a thumbnail (still being processed or uploaded before thumbnails existed) keep the original link
+    """
+
     class Meta:
-        fields = ('id', 'client_template_id', 'coach_comment', 'client_comment', 'start_date', 'end_date', 'completed', 'front', 'back', 'side_a', 'side_b', 'coach_viewed')
+        fields = ('id', 'client_template_id', 'coach_comment', 'client_comment', 'start_date', 'end_date', 'completed', 'front', 'back', 'side_a', 'side_b', 'coach_viewed', 'front_thumbnail', 'back_thumbnail', 'side_a_thumbnail', 'side_b_thumbnail')
+
+    def __init__(self, originals=False, **kwargs):
+        super().__init__(**kwargs)
+        self.originals = originals
+
+    @post_dump
+    def selectPhotos(self, data, **kwargs):
+        for field in PHOTO_FIELDS:
+            thumbnail = data.pop(field + '_thumbnail', None)
+            if not self.originals and thumbnail != None:
+                data[field] = thumbnail
+        return data
 
 check_in_schema = CheckInSchema()
-check_in_schemas = CheckInSchema(many=True) 
+check_in_schemas = CheckInSchema(many=True)
+check_in_original_schema = CheckInSchema(originals=True)
+check_in_original_schemas = CheckInSchema(originals=True, many=True)
+
+class PhotoUploadStatus(Enum):
+    PENDING = 'PENDING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+# Photo_uploads table, check in photos spooled by submitCheckin and uploaded with their thumbnails in the background
+class PhotoUpload(db.Model):
+    __tablename__ = "Photo_uploads"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # many to one relationship with Check_ins table
+    check_in_id = db.Column(db.Integer, db.ForeignKey('Check_ins.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # check in column the link is backfilled into (front, back, side_a or side_b)
+    field = db.Column(db.String, nullable=False)
+    # the spooled file only exists on the PHOTO_SPOOL_HOST that saved it, which is the only one claiming the upload
+    spool_host = db.Column(db.String, nullable=False, index=True)
+    spool_path = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default=PhotoUploadStatus.PENDING.name, index=True)
+    # link of the uploaded photo, set up front when submitCheckin uploaded the photo itself and only its thumbnail is left
+    link = db.Column(db.String, nullable=True)
+    thumbnail = db.Column(db.String, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # the upload isn't retried before next_attempt_at
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # a worker claims an upload by setting claimed_by, the claim lapses at locked_until if the worker dies
+    claimed_by = db.Column(db.String, nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    uploaded_at = db.Column(db.DateTime, nullable=True)
+
+class PhotoUploadSchema(ma.Schema):
+    class Meta:
+        fields = ('id', 'check_in_id', 'field', 'status', 'link', 'thumbnail', 'attempts', 'last_error', 'created_at', 'uploaded_at')
+
+photo_upload_schema = PhotoUploadSchema()
+photo_upload_schemas = PhotoUploadSchema(many=True)
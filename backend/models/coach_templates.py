@@ -7,15 +7,25 @@ class Exercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     category = db.Column(db.String, nullable=False)
     name = db.Column(db.String, nullable=False)
+    # catalog version the exercise was added or last changed in, clients sync the rows newer than their version
+    version = db.Column(db.Integer, nullable=False, default=0, index=True)
     # 1 to 1 relationship with Coach_Exercises table
 
 class ExerciseSchema(ma.Schema):
     class Meta:
-        fields = ('id', 'category', 'name')
+        fields = ('id', 'category', 'name', 'version')
 
 exercise_schema = ExerciseSchema()
 exercise_schemas = ExerciseSchema(many=True)
 
+# Catalog_versions table, a counter per catalog bumped in the same transaction as every write to the catalog so
+# workers caching it can tell it changed (see helpers.exercise_catalog)
+class CatalogVersion(db.Model):
+    __tablename__ = "Catalog_versions"
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 
 # Coach_exercises table
 class CoachExercise(db.Model):
@@ -24,15 +34,21 @@ class CoachExercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     # 1 to 1 relationship with Exercises
     exercise_id = db.Column(db.Integer, db.ForeignKey('Exercises.id'), nullable=False)
-    category = db.relationship(Exercise, lazy=True, uselist=False, single_parent=True, primaryjoin="Exercise.id==CoachExercise.exercise_id")
-    name = db.relationship(Exercise, lazy=True, uselist=False, single_parent=True, primaryjoin="Exercise.id==CoachExercise.exercise_id")
+    # the exercises of every coach exercise loaded by a query are loaded together in one extra query
+    exercise = db.relationship(Exercise, lazy='selectin', uselist=False)
     # many to 1 relationship with Coach_sessions table
     coach_session_id = db.Column(db.Integer, db.ForeignKey('Coach_sessions.id'), nullable=False)
     order = db.Column(db.Integer, nullable=False)  
 
+    @property
+    def name(self):
+        return self.exercise.name if self.exercise != None else None
+
+    @property
+    def category(self):
+        return self.exercise.category if self.exercise != None else None
+
 class CoachExerciseSchema(ma.Schema):
-    category = ma.Pluck('ExerciseSchema', 'category', many=False)
-    name = ma.Pluck('ExerciseSchema', 'name', many=False)
     class Meta:
         fields = ('id', 'exercise_id', 'coach_session_id', 'order', 'category', 'name')
 
@@ -75,13 +91,15 @@ class CoachTemplate(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String)
     slug = db.Column(db.String, nullable=False)
+    # coach that created the template
+    coach_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
     # 1 to many relationship with Coach_sessions table
     sessions = db.relationship('CoachSession', cascade="all, delete-orphan", lazy=True, order_by="CoachSession.order")
 
 class CoachTemplateSchema(ma.Schema):
     sessions = ma.Nested(PartialCoachSessionSchema, many=True)
     class Meta:
-        fields = ('id', 'name', 'sessions', 'slug')
+        fields = ('id', 'name', 'sessions', 'slug', 'coach_id')
 
 coach_template_schema = CoachTemplateSchema()
 coach_template_schemas = CoachTemplateSchema(many=True)
@@ -0,0 +1,30 @@
+from backend import db
+from enum import Enum
+import datetime
+
+class OutboxStatus(Enum):
+    PENDING = 'PENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+
+# Outbox_emails table, emails queued by requests and delivered by the outbox dispatcher
+class OutboxEmail(db.Model):
+    __tablename__ = "Outbox_emails"
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String, nullable=False)
+    sender = db.Column(db.String, nullable=False)
+    # comma separated list of recipients
+    recipients = db.Column(db.String, nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String, nullable=False, default=OutboxStatus.PENDING.name, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # the email isn't retried before next_attempt_at
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # a dispatcher claims an email by setting claimed_by, the claim lapses at locked_until if the dispatcher dies
+    claimed_by = db.Column(db.String, nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
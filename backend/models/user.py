@@ -3,6 +3,7 @@ from enum import Enum
 import jwt
 import datetime
 from backend.models.client_templates import ClientTemplate
+from backend.helpers.tokens import getCachedClaims, cacheClaims
 
 class Role(Enum):
     COACH = 'COACH'
@@ -21,6 +22,10 @@ class User(db.Model):
     check_in = db.Column(db.Boolean, nullable=True)
     coach_id = db.Column(db.Integer, nullable=True)
     access_token = db.Column(db.String, nullable=True)
+    # access token replaced by the last renewal and when it was renewed, requests still sending it within
+    # RENEWAL_GRACE_PERIOD seconds are switched over to access_token, whichever worker renewed it
+    previous_access_token = db.Column(db.String, nullable=True, index=True)
+    renewed_at = db.Column(db.DateTime, nullable=True)
     role = db.Column(db.String, nullable=False)
     verification_token = db.Column(db.String, nullable=True)
     verified = db.Column(db.Boolean, nullable=False)
@@ -58,9 +63,30 @@ class User(db.Model):
         :param auth_token:
         :return: integer|string
         """
+        payload = User.decode_auth_payload(auth_token)
+        if payload == 'Expired' or payload == 'Invalid':
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_payload(auth_token, verify_exp=True):
+        """
+        Decodes the auth token and returns the whole payload (exp, iat and sub)
+        :param auth_token:
+        :verify_exp: whether an expired token should be rejected
+        :return: dict|string
+        """
+        # Tokens that already passed verification skip the signature check and parsing until they expire
+        if verify_exp:
+            payload = getCachedClaims(auth_token)
+            if payload != None:
+                return payload
+
         try:
-            payload = jwt.decode(auth_token, app.config.get('SECRET_KEY'))
-            return payload['sub']
+            payload = jwt.decode(auth_token, app.config.get('SECRET_KEY'), options={'verify_exp': verify_exp})
+            if verify_exp:
+                cacheClaims(auth_token, payload)
+            return payload
         except jwt.ExpiredSignatureError:
             return 'Expired'
         except jwt.InvalidTokenError:
@@ -72,3 +98,10 @@ class UserSchema(ma.Schema):
 
 user_schema = UserSchema()
 user_schemas = UserSchema(many=True)
+
+# Users as coaches see them in the client list, without passwords or tokens
+class ClientSchema(ma.Schema):
+    class Meta:
+        fields = ('id', 'first_name', 'last_name', 'email', 'approved', 'check_in', 'coach_id', 'role', 'verified')
+
+client_schemas = ClientSchema(many=True)
@@ -0,0 +1,19 @@
+from backend import app
+from backend.helpers.photo_store import getStore, LocalPhotoStore, PHOTO_NAME
+from flask import send_from_directory
+import os
+
+@app.route("/photos/<name>", methods=["GET"])
+def getPhoto(name):
+    store = getStore()
+    if not isinstance(store, LocalPhotoStore) or not PHOTO_NAME.match(name) or not os.path.exists(store.path(name)):
+        return {
+            "error": "No photo found with name: " + name
+        }, 404
+
+    # send_file hands the open file to the server (sendfile under gunicorn) and answers conditional and range requests
+    max_age = app.config["PHOTO_STORE_CACHE_MAX_AGE"]
+    resp = send_from_directory(os.path.dirname(store.path(name)), name, cache_timeout=max_age)
+    # the name is the hash of the content, so the photo behind a link never changes
+    resp.headers['Cache-Control'] = 'public, max-age=' + str(max_age) + ', immutable'
+    return resp
@@ -1,12 +1,32 @@
-from backend import app, db, bcrypt, mail
-from backend.models.user import User, user_schema, Role, user_schemas
+from backend import app, db
+from backend.models.user import User, user_schema, Role, client_schemas
 from backend.helpers.emails import sendVerificationEmail, sendApprovedEmail
-from backend.helpers.imgur import createAlbum
+from backend.helpers.passwords import hashPassword, checkPassword
+from backend.helpers.email_validation import validateEmail
 from backend.middleware.middleware import http_guard
 from flask import request, session
-from email_validator import validate_email, EmailNotValidError
+from email_validator import EmailNotValidError
 import uuid
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import case, func, or_
+import math
+
+# Lists of the client list and the clients in them, by the approved field: approved clients are current clients,
+# unapproved clients are awaiting approval and clients without an approved value are past clients
+CLIENT_BUCKETS = {
+    "approvedClients": User.approved == True,
+    "unapprovedClients": User.approved == False,
+    "pastClients": User.approved == None
+}
+# Query parameters paging each list on its own
+CLIENT_BUCKET_PAGES = {
+    "approvedClients": 'approved_page',
+    "unapprovedClients": 'unapproved_page',
+    "pastClients": 'past_page'
+}
+CLIENT_COLUMNS = (
+    User.id, User.first_name, User.last_name, User.email, User.approved, User.check_in, User.coach_id, User.role, User.verified
+)
 
 @app.route('/getUser', methods=['GET'])
 @http_guard(renew=True, nullable=False)
@@ -79,7 +99,7 @@ def signUp():
 
     # Validate that the email is the correct format
     try:
-        v = validate_email(email) # validate and get info
+        v = validateEmail(email, check_deliverability=True) # validate and get info
         email = v["email"] # replace with normalized form
     except EmailNotValidError as e:
         # email is not valid, return error code
@@ -88,7 +108,7 @@ def signUp():
         }, 406
 
     # Encrypt the password
-    encodedPassword = bcrypt.generate_password_hash(body['password']).decode(encoding="utf-8")
+    encodedPassword = hashPassword(body['password'])
 
     # Check that they've passed a valid role
     try:
@@ -111,22 +131,7 @@ def signUp():
         verified=False
     )
 
-    # Create an album in imgur if we aren't being run by a test
-    create_album = True
-    if 'test' in body:
-        if body['test'] == True:
-            create_album = False
-
-    if create_album:
-        album_id, album_deletehash, code = createAlbum()
-        if code != 200:
-            print("Failed to create imgur album for user with code: " + str(code))
-            return {
-                "error": "Internal Server Error"
-            }, 500
-        
-        user.album_id = album_id
-        user.album_deletehash = album_deletehash
+    # The users imgur album is created when they first upload check in photos, see helpers.albums.ensureAlbum
 
     try:
         db.session.add(user)
@@ -170,7 +175,7 @@ def signUp():
     db.session.commit()
 
     # Send a verification email
-    err = sendVerificationEmail(mail, [user.email], user.first_name, user.last_name, str(verificationToken))
+    err = sendVerificationEmail([user.email], user.first_name, user.last_name, str(verificationToken))
     if err != None:
         print(err)
         db.session.rollback()
@@ -207,7 +212,7 @@ def updateProfile(token_claims):
     if 'email' in body:
         newEmail = True
         try:
-            v = validate_email(body["email"]) # validate and get info
+            v = validateEmail(body["email"], check_deliverability=True) # validate and get info
             email = v["email"] # replace with normalized form
         except EmailNotValidError as e:
             # email is not valid, return error code
@@ -234,12 +239,12 @@ def updateProfile(token_claims):
                 "error": "User must enter old password"
             }
         # check that oldPassword matches the password in the database
-        if not bcrypt.check_password_hash(user.password, body['oldPassword'].encode(encoding='utf-8')):
+        if not checkPassword(user.password, body['oldPassword']):
             return {
                 "error": "The old password doesn't match the password in the database"
             }, 400
         newPassword = True
-        encodedPassword = bcrypt.generate_password_hash(body['newPassword']).decode(encoding="utf-8")
+        encodedPassword = hashPassword(body['newPassword'])
     else:
         newPassword = False
 
@@ -306,7 +311,7 @@ def approveClient(token_claims):
     user = User.query.get(user.id)
 
     # Send an approved email
-    err = sendApprovedEmail(mail, [user.email], user.first_name, user.last_name)
+    err = sendApprovedEmail([user.email], user.first_name, user.last_name)
     if err != None:
         print(err)
         db.session.rollback()
@@ -335,39 +340,54 @@ def clientList(token_claims):
             "error": "Expected role of COACH"
     }, 400
 
-    # retrieve list of clients 
+    page_size = request.args.get('page_size')
+    coach_id = request.args.get('coach_id')
     try:
-        clients = User.query.filter_by(role='CLIENT').all()
-        result = user_schemas.dump(clients)
-        # create array's for type of client
-        approvedClients = []
-        unapprovedClients = []
-        pastClients = []
-        for client in result:
-            # remove sensitive data
-            del client['password']
-            del client['access_token']
-            del client['verification_token']
-
-            # check client's approved filed
-            # if approved this is a current client
-            if client['approved'] == True:
-                approvedClients.append(client)
-            # if unapproved this is a client awaiting approval
-            elif client['approved'] == False:
-                unapprovedClients.append(client)
-            # if null, this is a past client
-            else:
-                pastClients.append(client)
-        # Return the clients
-        # close db connection
-        db.session.close()
+        page_size = int(page_size) if page_size != None else None
+        # each list can be paged on its own, page applies to the lists without a page of their own
+        pages = {
+            bucket: int(request.args.get(CLIENT_BUCKET_PAGES[bucket], request.args.get('page', 1))) for bucket in CLIENT_BUCKETS
+        }
+        coach_id = int(coach_id) if coach_id != None else None
+    except ValueError:
+        return {
+            "error": "page, page_size and coach_id must be integers"
+        }, 400
+    if (page_size != None and page_size < 1) or min(pages.values()) < 1:
         return {
-            "approvedClients": approvedClients,
-            "unapprovedClients": unapprovedClients,
-            "pastClients": pastClients
+            "error": "page and page_size must be greater than 0"
+        }, 400
+
+    # clients awaiting approval don't have a coach yet, coach_id only scopes approved and past clients
+    clients = User.query.filter(User.role == Role.CLIENT.name)
+    if coach_id != None:
+        clients = clients.filter(or_(User.approved == False, User.coach_id == coach_id))
+
+    try:
+        # count every list in one query
+        counts = clients.with_entities(*[
+            func.count(case([(CLIENT_BUCKETS[bucket], 1)])) for bucket in CLIENT_BUCKETS
+        ]).one()
+        counts = dict(zip(CLIENT_BUCKETS.keys(), counts))
+
+        result = {
+            "counts": counts
         }
+        if page_size != None:
+            result["page_size"] = page_size
+            result["pages"] = pages
+            result["end_pages"] = {bucket: math.ceil(counts[bucket] / page_size) for bucket in CLIENT_BUCKETS}
+        for bucket in CLIENT_BUCKETS:
+            # only the columns the client list shows are selected
+            query = clients.filter(CLIENT_BUCKETS[bucket]).with_entities(*CLIENT_COLUMNS).order_by(User.id)
+            if page_size != None:
+                query = query.limit(page_size).offset((pages[bucket] - 1) * page_size)
+            result[bucket] = client_schemas.dump(query.all())
+        # close db connection
+        db.session.close()
+        return result
     except Exception as e:
+        print(e)
         return {
             "error": "Internal Server Error"
         }, 500
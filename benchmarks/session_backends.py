@@ -0,0 +1,85 @@
+"""
+Compares the per-request latency of the session backends selectable through SESSION_BACKEND.
+
+Every backend serves the same guarded-endpoint shape: the session cookie is read, session['access_token'] is looked up and
+the response goes back through save_session. The sqlalchemy backend runs against an in-memory SQLite database, so its
+numbers are a lower bound for the Postgres sessions table used in production.
+
+Usage:
+    python benchmarks/session_backends.py [requests per backend]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backend import app
+from backend.middleware.sessions import configureSessions, SESSION_BACKENDS
+from flask import session
+
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+app.config["TESTING"] = True
+
+TOKEN = 'x' * 180
+
+@app.route("/bench/login", methods=["GET"])
+def benchLogin():
+    session['access_token'] = TOKEN
+    return {
+        "success": True
+    }
+
+@app.route("/bench/session", methods=["GET"])
+def benchSession():
+    return {
+        "access_token": session.get('access_token') == TOKEN
+    }
+
+def benchmark(backend, requests):
+    """
+    Logs a test client in with the given backend and times requests that only read the session
+    Returns:
+        - sorted request latencies in milliseconds
+    """
+    app.config["SESSION_BACKEND"] = backend
+    configureSessions(app)
+    if backend == 'sqlalchemy':
+        app.session_interface.db.create_all()
+
+    client = app.test_client()
+    client.get('/bench/login')
+
+    # Warm up connections, caches and the jinja/werkzeug machinery before timing
+    for _ in range(20):
+        client.get('/bench/session')
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        resp = client.get('/bench/session')
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert resp.json['access_token'] == True
+
+    return sorted(latencies)
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    file_dir = tempfile.mkdtemp()
+    app.config["SESSION_FILE_DIR"] = file_dir
+
+    try:
+        print("{:<12} {:>10} {:>10} {:>10}".format("backend", "mean ms", "p50 ms", "p95 ms"))
+        for backend in SESSION_BACKENDS:
+            latencies = benchmark(backend, requests)
+            print("{:<12} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                backend, sum(latencies) / len(latencies), latencies[len(latencies) // 2],
+                latencies[int(len(latencies) * 0.95)]
+            ))
+    finally:
+        shutil.rmtree(file_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
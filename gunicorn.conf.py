@@ -0,0 +1,8 @@
+# gunicorn settings for the web dyno, see the Procfile
+
+def post_worker_init(worker):
+    # Runs in every worker once the gevent monkeypatching is done and the app is loaded, so the background tasks run
+    # as greenlets of the worker serving requests
+    from backend.helpers.tasks import startBackgroundTasks
+    started = startBackgroundTasks()
+    worker.log.info("Started background tasks: " + (", ".join(started) if len(started) != 0 else "none"))
@@ -0,0 +1,5 @@
+-- Thumbnails of the check in photos, stored by the photo upload worker when PHOTO_THUMBNAILS is on
+ALTER TABLE "Check_ins" ADD COLUMN IF NOT EXISTS front_thumbnail VARCHAR;
+ALTER TABLE "Check_ins" ADD COLUMN IF NOT EXISTS back_thumbnail VARCHAR;
+ALTER TABLE "Check_ins" ADD COLUMN IF NOT EXISTS side_a_thumbnail VARCHAR;
+ALTER TABLE "Check_ins" ADD COLUMN IF NOT EXISTS side_b_thumbnail VARCHAR;
@@ -0,0 +1,8 @@
+-- Coach that created each coach template, used to scope GET /coach/templates?coach_id=
+ALTER TABLE "Coach_templates" ADD COLUMN IF NOT EXISTS coach_id INTEGER REFERENCES users (id);
+CREATE INDEX IF NOT EXISTS "ix_Coach_templates_coach_id" ON "Coach_templates" (coach_id);
+
+-- Templates created before the column existed belong to the only coach when there is one, otherwise they stay unowned
+-- (listed without a coach_id filter only)
+UPDATE "Coach_templates" SET coach_id = (SELECT id FROM users WHERE role = 'COACH')
+WHERE coach_id IS NULL AND (SELECT count(*) FROM users WHERE role = 'COACH') = 1;
@@ -0,0 +1,10 @@
+-- Catalog version each exercise was added or last changed in. Existing exercises predate every versioned write, so they
+-- are backfilled with version 0 and reach clients through a full catalog fetch
+ALTER TABLE "Exercises" ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS "ix_Exercises_version" ON "Exercises" (version);
+
+-- Current version of the catalog, read by every GET /exercises, so it is created here as well as by db.create_all()
+CREATE TABLE IF NOT EXISTS "Catalog_versions" (
+    name VARCHAR NOT NULL PRIMARY KEY,
+    version INTEGER NOT NULL
+);
@@ -0,0 +1,18 @@
+-- Emails queued by signUp, approveClient and forgotPassword and sent by the outbox dispatcher
+CREATE TABLE IF NOT EXISTS "Outbox_emails" (
+    id SERIAL NOT NULL PRIMARY KEY,
+    subject VARCHAR NOT NULL,
+    sender VARCHAR NOT NULL,
+    recipients VARCHAR NOT NULL,
+    body TEXT,
+    html TEXT,
+    status VARCHAR NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error VARCHAR,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    claimed_by VARCHAR,
+    locked_until TIMESTAMP WITHOUT TIME ZONE,
+    sent_at TIMESTAMP WITHOUT TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS "ix_Outbox_emails_status" ON "Outbox_emails" (status);
@@ -0,0 +1,22 @@
+-- Check in photos spooled by submitCheckin and uploaded with their thumbnails by the photo upload worker
+CREATE TABLE IF NOT EXISTS "Photo_uploads" (
+    id SERIAL NOT NULL PRIMARY KEY,
+    check_in_id INTEGER NOT NULL REFERENCES "Check_ins" (id),
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    field VARCHAR NOT NULL,
+    spool_host VARCHAR NOT NULL,
+    spool_path VARCHAR NOT NULL,
+    status VARCHAR NOT NULL,
+    link VARCHAR,
+    thumbnail VARCHAR,
+    attempts INTEGER NOT NULL,
+    last_error VARCHAR,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    claimed_by VARCHAR,
+    locked_until TIMESTAMP WITHOUT TIME ZONE,
+    uploaded_at TIMESTAMP WITHOUT TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS "ix_Photo_uploads_check_in_id" ON "Photo_uploads" (check_in_id);
+CREATE INDEX IF NOT EXISTS "ix_Photo_uploads_status" ON "Photo_uploads" (status);
+CREATE INDEX IF NOT EXISTS "ix_Photo_uploads_spool_host" ON "Photo_uploads" (spool_host);
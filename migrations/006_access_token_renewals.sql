@@ -0,0 +1,5 @@
+-- Access token replaced by the last renewal and when it was renewed, lets every worker switch requests still sending
+-- the old cookie over to the new token for RENEWAL_GRACE_PERIOD seconds
+ALTER TABLE users ADD COLUMN IF NOT EXISTS previous_access_token VARCHAR;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS renewed_at TIMESTAMP WITHOUT TIME ZONE;
+CREATE INDEX IF NOT EXISTS ix_users_previous_access_token ON users (previous_access_token);
@@ -25,6 +25,7 @@ setup(
         'pytest-flask-sqlalchemy',
         'pytest-cov',
         'python-slugify',
-        'requests'
+        'requests',
+        'Pillow'
     ],
 )
@@ -4,15 +4,53 @@ import pytest
 import json
 import pdb
 import unittest
+import jwt
+import socket
+import threading
+import time
+import io
+import gc
 from backend import app, db, bcrypt, mail
 from backend.models.user import User, UserSchema, user_schema, Role
-from backend.models.client_templates import ClientTemplate, ClientSession, ClientExercise, CheckIn, TrainingEntry
-from backend.models.coach_templates import CoachTemplate, CoachSession, CoachExercise, Exercise
+from backend.models.client_templates import ClientTemplate, ClientSession, ClientExercise, CheckIn, TrainingEntry, check_in_schema, check_in_original_schema
+from backend.models.coach_templates import CoachTemplate, CoachSession, CoachExercise, Exercise, CatalogVersion
+from backend.helpers.tokens import claimsCacheStats
+from backend.middleware.sessions import configureSessions
+from backend.helpers.session_sweeper import sweepSessions
+from backend.helpers.passwords import passwordPoolStats, calibrateRounds
+from backend.helpers.email_validation import validateEmail, emailValidationStats, clearDomainCache
+from backend.helpers.outbox import dispatchOutbox
+from backend.helpers.tasks import startBackgroundTasks
+import backend.helpers.tasks
+from backend.helpers.emails import APPROVED_EMAIL, sendBatch
+from backend.helpers.albums import ensureAlbum, uploadImages
+from backend.helpers.images import prepareImage, imageStats
+from backend.helpers.http_client import HttpClient, MultipartBody
+from backend.helpers.pools import WorkerPool
+from backend.middleware.uploads import SpoolingRequest
+from backend.helpers.imgur import createAlbum, deleteAlbum
+import backend.helpers.albums
+import backend.helpers.photo_uploads
+from backend.helpers.photo_uploads import processPhotoUploads
+from backend.helpers.exercise_catalog import clearCatalogCache, catalogStats, catalogVersion, bumpCatalogVersion
+import backend.helpers.imgur
+import backend.helpers.tokens
+import backend.helpers.photo_store
+import backend.middleware.middleware
+from backend.middleware.middleware import renewToken, awaitRenewal, swapAccessToken, RENEWAL_GRACE_PERIOD
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from backend.models.outbox import OutboxEmail, OutboxStatus
+from email_validator import EmailNotValidError
+import email_validator
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from flask_session import Session
 from datetime import datetime as dt
 from datetime import date, timedelta
 from flask_mail import Mail
+from flask import request as flask_request
 
 DATE_FORMAT = '%Y-%m-%d'
 
@@ -64,6 +102,11 @@ def _db():
     # We need to use the production database in order to migrate the data because the models are attached to this
     # object
     db.create_all()
+    # the catalog cache outlives the rolled back transaction of the previous test
+    clearCatalogCache()
+    # collect what the previous test left behind, sessions replaced by a request are only weakly referenced so
+    # whether they survive a test shouldn't depend on the garbage of the tests before it
+    gc.collect()
 
     return db
 
@@ -184,6 +227,50 @@ def test_client_list(client, db_session):
     assert len(clients_resp['unapprovedClients']) != 0
     assert len(clients_resp['pastClients']) != 0
 
+def test_client_list_pagination(client, db_session):
+    coach = sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    coach_id = coach['user']['id']
+
+    # approved clients of this coach and of another coach, clients awaiting approval and a past client
+    clients = [
+        User(
+            first_name='approved' + str(i), last_name='client', email='approved' + str(i) + '@user.com',
+            password='fakepassword', role='CLIENT', verified=True, approved=True, coach_id=coach_id if i < 3 else coach_id + 1000
+        ) for i in range(5)
+    ] + [
+        User(
+            first_name='unapproved' + str(i), last_name='client', email='unapproved' + str(i) + '@user.com',
+            password='fakepassword', role='CLIENT', verified=True, approved=False
+        ) for i in range(2)
+    ] + [
+        User(
+            first_name='past', last_name='client', email='past@user.com', password='fakepassword', role='CLIENT',
+            verified=True, approved=None, coach_id=coach_id, access_token='token'
+        )
+    ]
+    db_session.bulk_save_objects(clients)
+    db_session.commit()
+
+    # each list is paged on its own and counted in full
+    resp, code = request(client, "GET", '/clientList?page_size=2&approved_page=3')
+    assert code == 200
+    assert resp['counts'] == {"approvedClients": 5, "unapprovedClients": 2, "pastClients": 1}
+    assert resp['end_pages'] == {"approvedClients": 3, "unapprovedClients": 1, "pastClients": 1}
+    assert [c['first_name'] for c in resp['approvedClients']] == ['approved4']
+    assert [c['first_name'] for c in resp['unapprovedClients']] == ['unapproved0', 'unapproved1']
+    assert 'password' not in resp['pastClients'][0] and 'access_token' not in resp['pastClients'][0]
+
+    # coach_id scopes the approved and past clients, clients awaiting approval are listed for every coach
+    resp, code = request(client, "GET", '/clientList?coach_id={}'.format(coach_id))
+    assert code == 200
+    assert resp['counts'] == {"approvedClients": 3, "unapprovedClients": 2, "pastClients": 1}
+    assert len(resp['approvedClients']) == 3 and 'end_pages' not in resp
+
+    resp, code = request(client, "GET", '/clientList?page=0&page_size=2')
+    assert code == 400
+
 def test_update_profile(client, db_session):
     # sign up as client
     client_user = sign_up_user_for_testing(client, test_client)
@@ -387,6 +474,584 @@ def test_approve_client(client, db_session):
     current_db_session.refresh(user)
     assert user.approved
 
+def test_stateless_http_guard(client, db_session):
+    app.config["AUTH_VERIFICATION_MODE"] = 'stateless'
+    try:
+        # sign up and login as client
+        client_user = sign_up_user_for_testing(client, test_client)
+        assert client_user['user'] != None
+        login_resp = login_user_for_testing(client, test_client)
+        assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+        # the token is verified without looking up its owner
+        resp, code = request(client, "GET", '/middleware')
+        assert code == 200
+        assert resp['token_claims']['id'] == client_user['user']['id']
+        assert resp['token_claims']['role'] == 'CLIENT'
+
+        # logging out revokes the token, replaying it should fail
+        token = User.query.get(client_user['user']['id']).access_token
+        logout_user_for_testing(client)
+        with client.session_transaction() as sess:
+            sess['access_token'] = token
+        resp, code = request(client, "GET", '/middleware')
+        assert code == 401
+        assert resp['error'] == "Unauthorized. Invalid access token"
+    finally:
+        app.config["AUTH_VERIFICATION_MODE"] = 'db'
+
+def test_token_renewal(client, db_session):
+    # sign up and login as client
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    # expire the users access_token
+    expired_token = jwt.encode({
+        'exp': dt.utcnow() - timedelta(hours=1),
+        'iat': dt.utcnow() - timedelta(hours=3),
+        'sub': {'id': client_user['user']['id'], 'role': 'CLIENT'}
+    }, app.config.get('SECRET_KEY'), algorithm='HS256').decode(encoding="utf-8")
+    user = User.query.get(client_user['user']['id'])
+    user.access_token = expired_token
+    db_session.commit()
+    with client.session_transaction() as sess:
+        sess['access_token'] = expired_token
+
+    # the expired token is renewed
+    resp, code = request(client, "GET", '/middleware')
+    assert code == 200
+    renewed_token = User.query.get(client_user['user']['id']).access_token
+    assert renewed_token != expired_token
+
+    # a request still carrying the expired token reuses the renewal instead of renewing again
+    with client.session_transaction() as sess:
+        sess['access_token'] = expired_token
+    resp, code = request(client, "GET", '/middleware')
+    assert code == 200
+    assert resp['token_claims']['id'] == client_user['user']['id']
+    assert User.query.get(client_user['user']['id']).access_token == renewed_token
+    with client.session_transaction() as sess:
+        assert sess['access_token'] == renewed_token
+
+def test_concurrent_token_renewal(client, db_session, monkeypatch):
+    swaps = []
+    def slowSwap(user, expired_token):
+        swaps.append(expired_token)
+        time.sleep(0.2)
+        return 'renewed-' + expired_token
+    monkeypatch.setattr(backend.middleware.middleware, 'swapAccessToken', slowSwap)
+    monkeypatch.setattr(backend.middleware.middleware, 'session', {})
+
+    # concurrent requests carrying the same expired token share a single renewal
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(renewToken(None, 'expired-token'))) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tokens == ['renewed-expired-token'] * 5
+    assert swaps == ['expired-token']
+
+    # a request that no longer finds the expired token in the db waits for the renewal still in flight
+    leader = threading.Thread(target=renewToken, args=(None, 'other-expired-token'))
+    leader.start()
+    time.sleep(0.05)
+    assert awaitRenewal('other-expired-token') == 'renewed-other-expired-token'
+    leader.join()
+    assert awaitRenewal('unknown-token') == None
+
+    # a worker losing the compare-and-swap reuses the token the winner wrote
+    monkeypatch.undo()
+    client_user = sign_up_user_for_testing(client, test_client)
+    user = User.query.get(client_user['user']['id'])
+    winner_token = user.encode_auth_token({'id': user.id, 'role': user.role})
+    user.access_token = winner_token
+    db_session.commit()
+    assert swapAccessToken(user, 'expired-token') == winner_token
+
+    # unless the users token expired too
+    user.access_token = jwt.encode({
+        'exp': dt.utcnow() - timedelta(hours=1),
+        'iat': dt.utcnow() - timedelta(hours=3),
+        'sub': {'id': user.id, 'role': 'CLIENT'}
+    }, app.config.get('SECRET_KEY'), algorithm='HS256').decode(encoding="utf-8")
+    db_session.commit()
+    assert swapAccessToken(user, 'expired-token') == None
+
+def test_token_renewal_across_workers(client, db_session, monkeypatch):
+    # tokens revoked by earlier tests of this process belong to users with the same ids
+    monkeypatch.setattr(backend.helpers.tokens, '_revoked_tokens', {})
+    monkeypatch.setattr(backend.helpers.tokens, '_revoked_users', {})
+
+    client_user = sign_up_user_for_testing(client, test_client)
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    for mode in ['db', 'stateless']:
+        monkeypatch.setitem(app.config, "AUTH_VERIFICATION_MODE", mode)
+
+        # another worker renews the expired token, nothing about the renewal is known in this worker
+        expired_token = jwt.encode({
+            'exp': dt.utcnow() - timedelta(hours=1),
+            'iat': dt.utcnow() - timedelta(hours=3),
+            'sub': {'id': client_user['user']['id'], 'role': 'CLIENT'},
+            'mode': mode
+        }, app.config.get('SECRET_KEY'), algorithm='HS256').decode(encoding="utf-8")
+        user = User.query.get(client_user['user']['id'])
+        user.access_token = expired_token
+        db_session.commit()
+        renewed_token = swapAccessToken(user, expired_token)
+        assert renewed_token != None and renewed_token != expired_token
+        assert backend.middleware.middleware._renewals == {}
+
+        # a request still sending the old cookie is switched over to the renewed token
+        with client.session_transaction() as sess:
+            sess['access_token'] = expired_token
+        resp, code = request(client, "GET", '/middleware')
+        assert code == 200
+        assert resp['token_claims']['id'] == client_user['user']['id']
+        assert User.query.get(client_user['user']['id']).access_token == renewed_token
+        with client.session_transaction() as sess:
+            assert sess['access_token'] == renewed_token
+
+        # once the grace period is over the old cookie is rejected
+        user = User.query.get(client_user['user']['id'])
+        user.renewed_at = dt.utcnow() - timedelta(seconds=RENEWAL_GRACE_PERIOD + 1)
+        db_session.commit()
+        with client.session_transaction() as sess:
+            sess['access_token'] = expired_token
+        resp, code = request(client, "GET", '/middleware')
+        assert code == 401
+
+def test_memory_session_backend(client, db_session):
+    app.config["SESSION_BACKEND"] = 'memory'
+    configureSessions(app)
+    try:
+        # sign up and login as client, the session is kept in process
+        client_user = sign_up_user_for_testing(client, test_client)
+        assert client_user['user'] != None
+        login_resp = login_user_for_testing(client, test_client)
+        assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+        resp, code = request(client, "GET", '/middleware')
+        assert code == 200
+        assert resp['token_claims']['id'] == client_user['user']['id']
+
+        # logging out removes the access_token from the session
+        logout_user_for_testing(client)
+        resp, code = request(client, "GET", '/middleware')
+        assert code == 401
+    finally:
+        app.config["SESSION_BACKEND"] = 'sqlalchemy'
+        configureSessions(app)
+
+def test_unmodified_session_not_saved(client, db_session):
+    # Use the session interface that skips unmodified sessions
+    configureSessions(app)
+    app.session_interface.db.create_all()
+
+    # sign up and login as client, this modifies the session so it is saved
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    # reading the session doesn't write it back
+    resp = client.get('/middleware')
+    assert resp._status_code == 200
+    assert 'Set-Cookie' not in resp.headers
+
+    # logging out modifies the session, so the session is deleted
+    resp = client.get('/auth/logout')
+    assert resp._status_code == 200
+    assert 'Set-Cookie' in resp.headers
+    resp, code = request(client, "GET", '/middleware')
+    assert code == 401
+
+def test_sweep_sessions(client, db_session):
+    # sign up and login as client so that there is a live session
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    user = User.query.get(client_user['user']['id'])
+
+    # Add an expired session, an orphaned session and a session that is still in use
+    session_model = app.session_interface.sql_session_model
+    session_db = app.session_interface.db
+    serializer = app.session_interface.serializer
+    session_db.session.add(session_model('session:test-expired', serializer.dumps({'access_token': user.access_token}), dt.utcnow() - timedelta(days=1)))
+    session_db.session.add(session_model('session:test-orphaned', serializer.dumps({'access_token': 'logged-out-token'}), dt.utcnow() + timedelta(days=1)))
+    session_db.session.add(session_model('session:test-live', serializer.dumps({'access_token': user.access_token}), dt.utcnow() + timedelta(days=1)))
+    session_db.session.commit()
+
+    result = sweepSessions(batch_size=1)
+    assert result['expired'] >= 1
+    assert result['orphaned'] >= 1
+    assert session_model.query.filter_by(session_id='session:test-expired').first() == None
+    assert session_model.query.filter_by(session_id='session:test-orphaned').first() == None
+    assert session_model.query.filter_by(session_id='session:test-live').first() != None
+    session_model.query.filter_by(session_id='session:test-live').delete()
+    session_db.session.commit()
+
+    # the logged in client still has its session
+    resp, code = request(client, "GET", '/middleware')
+    assert code == 200
+
+def test_claims_cache(client, db_session):
+    # sign up and login as client
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    # repeat requests with the same token are served from the claims cache
+    request(client, "GET", '/middleware')
+    stats = claimsCacheStats()
+    resp, code = request(client, "GET", '/middleware')
+    assert code == 200
+    assert resp['token_claims']['id'] == client_user['user']['id']
+    assert claimsCacheStats()['hits'] > stats['hits']
+    assert claimsCacheStats()['misses'] == stats['misses']
+
+def test_process_pool_failures(client, db_session):
+    pool = WorkerPool('test-processes', 2, processes=True)
+
+    # concurrent first uses create a single pool
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(pool._getPool())) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(id(p) for p in pools)) == 1
+
+    # failed tasks are counted as started and completed
+    results = pool.runAll(int, [('1',), ('x',)])
+    assert results[0] == (1, None)
+    assert isinstance(results[1][1], ValueError)
+    with pytest.raises(ValueError):
+        pool.run(int, 'y')
+    stats = pool.stats()
+    assert stats['completed'] == 3
+    assert stats['running'] == 0 and stats['queue_depth'] == 0
+    pool._getPool().shutdown()
+
+def test_password_pool(client, db_session):
+    # sign up hashes the password and login checks it on the password pool
+    stats = passwordPoolStats()
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    assert passwordPoolStats()['completed'] == stats['completed'] + 2
+    assert passwordPoolStats()['queue_depth'] == 0
+
+    # a wrong password is still rejected
+    resp, code = request(client, "POST", '/auth/login', {"email": test_client['email'], "password": "wrongpassword"})
+    assert code == 404
+
+def test_rehash_on_login(client, db_session, monkeypatch):
+    # sign up with the configured work factor
+    monkeypatch.setitem(app.config, "BCRYPT_LOG_ROUNDS", 4)
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    user = User.query.filter_by(id=client_user['user']['id']).first()
+    assert user.password.split('$')[2] == '04'
+
+    # logging in after the work factor is raised rehashes the stored password
+    monkeypatch.setitem(app.config, "BCRYPT_LOG_ROUNDS", 5)
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    user = User.query.filter_by(id=client_user['user']['id']).first()
+    assert user.password.split('$')[2] == '05'
+
+    # a lower work factor never downgrades it, and the rehashed password still logs in
+    monkeypatch.setitem(app.config, "BCRYPT_LOG_ROUNDS", 4)
+    login_resp = login_user_for_testing(client, test_client)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    user = User.query.filter_by(id=client_user['user']['id']).first()
+    assert user.password.split('$')[2] == '05'
+
+    # calibration stays within the configured bounds
+    assert calibrateRounds(target_ms=0, min_rounds=4, max_rounds=6) == 4
+    assert 4 <= calibrateRounds(target_ms=10000, min_rounds=4, max_rounds=6) <= 6
+
+def test_email_domain_cache(client, db_session, monkeypatch):
+    lookups = []
+    def resolve(domain, domain_i18n, timeout=None):
+        lookups.append(domain)
+        if domain == 'nomail.example':
+            raise email_validator.EmailUndeliverableError("The domain name nomail.example does not exist.")
+        return {"mx": [(10, 'mx.' + domain)], "mx-fallback": None}
+    monkeypatch.setattr(email_validator, 'validate_email_deliverability', resolve)
+    clearDomainCache()
+
+    # syntax checks don't resolve the domain
+    assert validateEmail('Someone@Example.com')['email'] == 'Someone@example.com'
+    assert lookups == []
+
+    # deliverability checks resolve each domain once
+    stats = emailValidationStats()
+    validateEmail('one@example.com', check_deliverability=True)
+    validateEmail('two@example.com', check_deliverability=True)
+    assert lookups == ['example.com']
+    assert emailValidationStats()['hits'] == stats['hits'] + 1
+    assert emailValidationStats()['resolver_calls'] == stats['resolver_calls'] + 1
+
+    # undeliverable domains are cached too
+    for _ in range(2):
+        with pytest.raises(EmailNotValidError):
+            validateEmail('one@nomail.example', check_deliverability=True)
+    assert lookups == ['example.com', 'nomail.example']
+
+    # sign up rejects undeliverable addresses
+    resp, code = request(client, "POST", '/signUp', dict(test_client, email='client@nomail.example'))
+    assert code == 406
+
+def test_background_tasks(client, db_session, monkeypatch):
+    # importing the app doesn't start any background task, the web server workers start them
+    assert [thread.name for thread in threading.enumerate() if thread.name in ('session-sweeper', 'email-outbox', 'photo-uploads')] == []
+
+    started = []
+    monkeypatch.setattr(backend.helpers.tasks, 'startPeriodicTask', lambda name, interval, task, wakeup=None: started.append(name))
+    monkeypatch.setattr(backend.helpers.tasks, '_started_pid', None)
+    monkeypatch.setitem(app.config, "SESSION_SWEEP_INTERVAL", 0)
+    monkeypatch.setitem(app.config, "EMAIL_OUTBOX_INTERVAL", 5)
+    monkeypatch.setitem(app.config, "PHOTO_UPLOAD_MODE", 'background')
+    assert startBackgroundTasks() == ['email-outbox', 'photo-uploads']
+    assert started == ['email-outbox', 'photo-uploads']
+
+    # a worker only starts them once
+    assert startBackgroundTasks() == []
+    assert started == ['email-outbox', 'photo-uploads']
+
+def test_email_outbox(client, db_session, monkeypatch):
+    smtpd = pytest.importorskip('smtpd')
+    import asyncore
+
+    # local SMTP sink that records the messages it receives
+    class SMTPSink(smtpd.SMTPServer):
+        def __init__(self):
+            smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+            self.messages = []
+
+        def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+            self.messages.append((rcpttos, data))
+
+    sink = SMTPSink()
+    sink_thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+    sink_thread.start()
+    monkeypatch.setitem(app.config, "MAIL_SERVER", '127.0.0.1')
+    monkeypatch.setitem(app.config, "MAIL_PORT", sink.socket.getsockname()[1])
+    monkeypatch.setitem(app.config, "MAIL_USE_TLS", False)
+    monkeypatch.setitem(app.config, "MAIL_USERNAME", None)
+    monkeypatch.setitem(app.config, "MAIL_SUPPRESS_SEND", False)
+    Mail(app)
+
+    try:
+        # sign up queues the verification email instead of sending it
+        client_user = sign_up_user_for_testing(client, test_client)
+        assert client_user['user'] != None
+        email = OutboxEmail.query.filter_by(recipients=test_client['email']).first()
+        assert email.status == OutboxStatus.PENDING.name
+        assert sink.messages == []
+
+        # the dispatcher delivers it to the SMTP server
+        with app.app_context():
+            result = dispatchOutbox()
+        assert result['sent'] == 1
+        assert email.status == OutboxStatus.SENT.name
+        assert len(sink.messages) == 1
+        assert sink.messages[0][0] == [test_client['email']]
+        assert b'Welcome To Coach Easy!' in sink.messages[0][1]
+        with app.app_context():
+            assert dispatchOutbox()['sent'] == 0
+    finally:
+        sink.close()
+        sink_thread.join()
+
+    # emails that can't be delivered are retried later
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    monkeypatch.setitem(app.config, "MAIL_PORT", closed.getsockname()[1])
+    closed.close()
+    Mail(app)
+    url = '/forgotPassword?email={}'.format(test_client['email'])
+    resp, code = request(client, "GET", url)
+    assert code == 200
+    with app.app_context():
+        result = dispatchOutbox()
+    assert result['retried'] == 1
+    email = OutboxEmail.query.filter_by(subject="Forgot Password?").first()
+    assert email.status == OutboxStatus.PENDING.name
+    assert email.attempts == 1 and email.last_error != None
+    assert email.next_attempt_at > dt.utcnow()
+    with app.app_context():
+        assert dispatchOutbox()['retried'] == 0
+
+def test_email_batch(client, db_session):
+    # every recipient gets both parts rendered from their own parameters
+    messages = APPROVED_EMAIL.renderBatch([
+        (['one@client.com'], {"name": 'One Client', "callback": 'https://coacheasy.test/login'}),
+        (['two@client.com'], {"name": 'Tom & Two', "callback": 'https://coacheasy.test/login'})
+    ])
+    assert [msg.recipients for msg in messages] == [['one@client.com'], ['two@client.com']]
+    assert messages[0].subject == "You've Been Approved!"
+    assert messages[0].body.startswith('Hello One Client,\n')
+    assert messages[0].body.endswith('\nhttps://coacheasy.test/login')
+    assert 'One Client' in messages[0].html and 'https://coacheasy.test/login' in messages[0].html
+    # only the html part is escaped
+    assert messages[1].body.startswith('Hello Tom & Two,\n')
+    assert 'Tom &amp; Two' in messages[1].html
+
+    # a batch is queued in the outbox together
+    err = sendBatch(APPROVED_EMAIL, [(['one@client.com'], {"name": 'One Client', "callback": ''}), (['two@client.com'], {"name": 'Two Client', "callback": ''})])
+    assert err == None
+    assert OutboxEmail.query.filter_by(subject="You've Been Approved!").count() == 2
+
+def test_ensure_album(client, db_session, monkeypatch):
+    created = []
+    deleted = []
+    def createAlbum():
+        created.append('album' + str(len(created)))
+        return created[-1], created[-1] + '-deletehash', 200
+    def deleteAlbum(album):
+        deleted.append(album)
+        return 200
+    monkeypatch.setattr(backend.helpers.albums, 'createAlbum', createAlbum)
+    monkeypatch.setattr(backend.helpers.albums, 'deleteAlbum', deleteAlbum)
+
+    # sign up doesn't create an album
+    client_user = sign_up_user_for_testing(client, test_client)
+    user = User.query.get(client_user['user']['id'])
+    assert user.album_id == None and user.album_deletehash == None
+
+    # the first upload creates it, later uploads reuse it
+    assert ensureAlbum(user) == ('album0-deletehash', 200)
+    assert ensureAlbum(User.query.get(user.id)) == ('album0-deletehash', 200)
+    assert created == ['album0']
+
+    # a worker that loses the race keeps the stored album and deletes its own
+    coach_user = sign_up_user_for_testing(client, test_coach)
+    coach = User.query.get(coach_user['user']['id'])
+    def createAlbumLosingRace():
+        User.query.filter_by(id=coach.id).update({'album_id': 'winner', 'album_deletehash': 'winner-deletehash'}, synchronize_session=False)
+        return createAlbum()
+    monkeypatch.setattr(backend.helpers.albums, 'createAlbum', createAlbumLosingRace)
+    assert ensureAlbum(coach) == ('winner-deletehash', 200)
+    assert coach.album_id == 'winner'
+    assert deleted == ['album1-deletehash']
+
+def test_upload_images(client, db_session, monkeypatch):
+    deleted = []
+    def addImage(album, image):
+        time.sleep(0.2)
+        name = image.read().decode()
+        if name == 'broken':
+            return None, None, 400
+        return 'https://i.imgur.com/' + name + '.jpg', name + '-deletehash', 200
+    def deleteImage(image):
+        deleted.append(image)
+        return 200
+    monkeypatch.setattr(backend.helpers.albums, 'addImage', addImage)
+    monkeypatch.setattr(backend.helpers.albums, 'deleteImage', deleteImage)
+
+    # images are uploaded concurrently and timed individually
+    start = time.time()
+    links, uploads = uploadImages('album', {name: io.BytesIO(name.encode()) for name in ['front', 'back', 'side_a', 'side_b']})
+    assert time.time() - start < 0.6
+    assert links == {name: 'https://i.imgur.com/' + name + '.jpg' for name in ['front', 'back', 'side_a', 'side_b']}
+    assert uploads['front']['status'] == 200 and uploads['front']['ms'] >= 200
+
+    # a failed upload fails the whole batch and removes the images that were uploaded
+    links, uploads = uploadImages('album', {'front': io.BytesIO(b'front'), 'back': io.BytesIO(b'broken')})
+    assert links == None
+    assert uploads['back']['status'] == 400
+    assert deleted == ['front-deletehash']
+
+def test_prepare_image(client, db_session):
+    # a large photo with EXIF metadata, as phones upload them
+    photo = Image.new('RGB', (4000, 3000), (120, 80, 40))
+    exif = photo.getexif()
+    exif[0x010F] = 'Phone'
+    original = io.BytesIO()
+    photo.save(original, format='JPEG', quality=100, exif=exif)
+    original = original.getvalue()
+
+    data, saved = prepareImage(original)
+    prepared = Image.open(io.BytesIO(data))
+    assert max(prepared.size) <= app.config["IMAGE_MAX_DIMENSION"]
+    assert prepared.size[0] * 3 == prepared.size[1] * 4
+    assert len(prepared.getexif()) == 0
+    assert saved == len(original) - len(data) and saved > 0
+    assert imageStats()["bytes_saved"] >= saved
+
+    # images that can't be decoded are uploaded unchanged
+    skipped = imageStats()["skipped"]
+    assert prepareImage(b'not an image') == (b'not an image', 0)
+    assert imageStats()["skipped"] == skipped + 1
+
+def test_imgur_client(client, db_session, monkeypatch):
+    # local stand-in for the imgur api that answers with the queued statuses, then 200
+    class ImgurStandIn(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def respond(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            status = self.server.statuses.pop(0) if len(self.server.statuses) != 0 else 200
+            self.server.received.append((self.command, self.path, self.client_address[1]))
+            body = json.dumps({"status": status, "data": {"id": 'album', "deletehash": 'album-deletehash'}}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_POST = respond
+        do_DELETE = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImgurStandIn)
+    server.statuses = []
+    server.received = []
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    monkeypatch.setitem(app.config, "IMGUR_ROOT_URL", 'http://127.0.0.1:' + str(server.server_address[1]) + '/3')
+    monkeypatch.setattr(backend.helpers.imgur, 'client', HttpClient('imgur', 2, 1, 1, 2, 0.01, 3, 60))
+
+    try:
+        # requests reuse the same keep-alive connection
+        assert createAlbum() == ('album', 'album-deletehash', 200)
+        assert createAlbum() == ('album', 'album-deletehash', 200)
+        assert [request[:2] for request in server.received] == [('POST', '/3/album'), ('POST', '/3/album')]
+        assert server.received[0][2] == server.received[1][2]
+
+        # unavailable responses are retried
+        server.statuses = [503]
+        assert createAlbum() == ('album', 'album-deletehash', 200)
+        assert len(server.received) == 4
+
+        # other server errors, including gateway errors, only retry idempotent requests, the third failure in a row
+        # opens the circuit breaker
+        server.statuses = [502, 504, 500, 500]
+        assert createAlbum() == (None, None, 502)
+        assert len(server.received) == 5
+        assert deleteAlbum('album-deletehash') == 503
+        assert len(server.received) == 7
+        assert backend.helpers.imgur.client.breaker.state() == 'open'
+
+        # while the breaker is open requests fail fast without reaching imgur
+        assert deleteAlbum('album-deletehash') == 503
+        assert len(server.received) == 7
+    finally:
+        server.shutdown()
+        server.server_close()
+
 #  ------------------------------------------- CLIENT TEMPLATES ------------------------------------------------------
 def test_get_client_template(client, db_session):
     # Create and sign into the client
@@ -1178,6 +1843,59 @@ def test_get_coach_templates(client, db_session):
     assert resp['templates'][1]['id'] == template1.id or resp['templates'][1]['id'] == template2.id
 
 
+def test_get_coach_templates_pages(client, db_session):
+    coach = sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    coach_id = coach['user']['id']
+
+    def addTemplates(count, owner):
+        for i in range(count):
+            db_session.add(CoachTemplate(
+                name='Template ' + str(owner) + '-' + str(i), slug='template', coach_id=owner, sessions=[
+                    CoachSession(name='Session ' + str(order), slug='session', order=order) for order in range(3)
+                ]
+            ))
+        db_session.commit()
+
+    # the listing costs the same number of queries however many templates there are
+    statements = []
+    def countStatement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', countStatement)
+    try:
+        addTemplates(2, coach_id)
+        del statements[:]
+        resp, code = request(client, "GET", '/coach/templates')
+        assert code == 200 and len(resp['templates']) == 2
+        few = len(statements)
+
+        addTemplates(20, coach_id)
+        addTemplates(3, coach_id + 1000)
+        del statements[:]
+        resp, code = request(client, "GET", '/coach/templates')
+        assert code == 200 and len(resp['templates']) == 25
+        assert len(statements) == few
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', countStatement)
+    assert [session['order'] for session in resp['templates'][0]['sessions']] == [0, 1, 2]
+    assert resp['next'] == None
+
+    # pages follow on from the last template of the previous page
+    resp, code = request(client, "GET", '/coach/templates?limit=10&coach_id={}'.format(coach_id))
+    assert code == 200
+    assert len(resp['templates']) == 10 and resp['next'] == resp['templates'][-1]['id']
+    ids = [template['id'] for template in resp['templates']]
+    while resp['next'] != None:
+        resp, code = request(client, "GET", '/coach/templates?limit=10&coach_id={}&after={}'.format(coach_id, resp['next']))
+        assert code == 200
+        ids += [template['id'] for template in resp['templates']]
+    assert len(ids) == 22 and ids == sorted(ids)
+    assert all(template['coach_id'] == coach_id for template in resp['templates'])
+
+    resp, code = request(client, "GET", '/coach/templates?limit=0')
+    assert code == 400
+
 def test_post_coach_template(client, db_session):
     result, code = role_check(client, db_session, "POST", '/coach/template')
     assert code == 401
@@ -1205,6 +1923,60 @@ def test_post_coach_template(client, db_session):
     assert result['name'] == 'Test Coach Template 2'
     assert result['slug'] == 'test-coach-template-2'
 
+def test_post_coach_template_new_exercises(client, db_session, monkeypatch):
+    sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    # an invalid coach exercise fails the request before anything is written
+    template = {
+        'name': 'Batched template',
+        'sessions': [
+            {'name': 'Session 1', 'order': 1, 'coach_exercises': [
+                {'category': 'Legs', 'name': 'Squats', 'order': 1},
+                {'category': 'Legs', 'name': 'Lunges', 'order': 2}
+            ]},
+            {'name': 'Session 2', 'order': 2, 'coach_exercises': [{'category': 'Back', 'order': 1}]}
+        ]
+    }
+    result, code = request(client, "POST", "/coach/template", data=template)
+    assert code == 400
+    assert db_session.query(Exercise).count() == 0 and catalogVersion() == 0
+
+    # the new exercises of every session are created together in one catalog version
+    template['sessions'][1]['coach_exercises'] = [{'category': 'Back', 'name': 'Rows', 'order': 1}]
+    result, code = request(client, "POST", "/coach/template", data=template)
+    assert code == 200
+    assert catalogVersion() == 1
+    exercises = db_session.query(Exercise).order_by(Exercise.id).all()
+    assert [(exercise.name, exercise.version) for exercise in exercises] == [('Squats', 1), ('Lunges', 1), ('Rows', 1)]
+    session, code = request(client, "GET", '/coach/session?coach_session_id={}'.format(result['sessions'][0]['id']))
+    assert [exercise['name'] for exercise in session['coach_exercises']] == ['Squats', 'Lunges']
+
+    # sessions mix existing and new exercises
+    result, code = request(client, "POST", "/coach/session", data={
+        'coach_template_id': result['id'], 'name': 'Session 3', 'coach_exercises': [
+            {'exercise_id': exercises[2].id, 'order': 1}, {'category': 'Arms', 'name': 'Curls', 'order': 2}
+        ]
+    })
+    assert code == 200
+    assert [exercise['name'] for exercise in result['coach_exercises']] == ['Rows', 'Curls']
+    assert catalogVersion() == 2
+
+    # a failure while writing the new exercises is rolled back and answered with an error
+    def flush():
+        raise OperationalError('INSERT INTO "Exercises"', {}, Exception('database is locked'))
+    monkeypatch.setattr(db.session, 'flush', flush)
+    template['name'] = 'Failed template'
+    result, code = request(client, "POST", "/coach/template", data=template)
+    assert code == 500 and result['error'] == "Internal Server Error"
+    result, code = request(client, "POST", "/coach/session", data={
+        'coach_template_id': session['coach_template_id'], 'name': 'Session 4', 'coach_exercises': [{'category': 'Arms', 'name': 'Dips', 'order': 1}]
+    })
+    assert code == 500 and result['error'] == "Internal Server Error"
+    monkeypatch.undo()
+    assert db_session.query(Exercise).count() == 4 and catalogVersion() == 2
+
 def test_put_coach_template(client, db_session):
     result, code = role_check(client, db_session, "PUT", '/coach/template')
     assert code == 401
@@ -1317,6 +2089,48 @@ def test_get_coach_session(client, db_session):
     assert coach_session['id'] == resp['sessions'][0]['id']
 
 
+def test_get_coach_session_queries(client, db_session):
+    sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    exercises = [Exercise(category='Category ' + str(i), name='Exercise ' + str(i)) for i in range(12)]
+    db_session.add_all(exercises)
+    db_session.commit()
+    sessions = []
+    for count in [2, 12]:
+        session = CoachSession(name='Session', slug='session', order=1, coach_exercises=[
+            CoachExercise(exercise_id=exercises[i].id, order=i) for i in range(count)
+        ])
+        db_session.add(CoachTemplate(name='Template ' + str(count), slug='template-' + str(count), sessions=[session]))
+        sessions.append(session)
+    db_session.commit()
+    db_session.expire_all()
+
+    # the exercises of a session are loaded in one query however many there are
+    statements = []
+    def countStatement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', countStatement)
+    try:
+        counts = []
+        for session in sessions:
+            del statements[:]
+            resp, code = request(client, "GET", '/coach/session?coach_session_id={}'.format(session.id))
+            assert code == 200
+            # session bookkeeping writes vary between requests, only the template queries are compared
+            counts.append(len([statement for statement in statements if '"Coach_' in statement or '"Exercises"' in statement]))
+            db_session.expire_all()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', countStatement)
+    assert counts[0] == counts[1]
+    assert len(resp['coach_exercises']) == 12
+    assert [(e['name'], e['category']) for e in resp['coach_exercises'][:2]] == [('Exercise 0', 'Category 0'), ('Exercise 1', 'Category 1')]
+
+    resp, code = request(client, "GET", '/coach/exercise?coach_exercise_id={}'.format(resp['coach_exercises'][1]['id']))
+    assert code == 200
+    assert resp['name'] == 'Exercise 1' and resp['category'] == 'Category 1'
+
 def test_post_coach_session(client, db_session):
     result, code = role_check(client, db_session, "POST", '/coach/session')
     assert code == 401
@@ -1480,6 +2294,86 @@ def test_post_exercise(client, db_session):
     assert result['exercises'][0]['name'] == body['name']
 
 
+def test_exercise_catalog_cache(client, db_session, monkeypatch):
+    sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    result, code = request(client, "POST", "/exercise", data={'category': 'Back', 'name': 'Lateral Rows'})
+    assert code == 200 and len(result['exercises']) == 1
+    assert catalogVersion() == 1
+
+    # warm reads are served from the cache without querying the catalog
+    result, code = request(client, "GET", "/exercises")
+    rebuilds = catalogStats()["rebuilds"]
+    for i in range(3):
+        result, code = request(client, "GET", "/exercises")
+        assert code == 200 and len(result['exercises']) == 1
+    assert catalogStats()["rebuilds"] == rebuilds
+
+    # a write by another worker bumps the version, the cache is rebuilt on the next check
+    monkeypatch.setitem(app.config, "EXERCISE_CATALOG_CHECK_INTERVAL", 0)
+    db_session.add(Exercise(category='Legs', name='Squats'))
+    db_session.query(CatalogVersion).filter_by(name='exercises').update({'version': CatalogVersion.version + 1})
+    db_session.commit()
+    result, code = request(client, "GET", "/exercises")
+    assert [exercise['name'] for exercise in result['exercises']] == ['Lateral Rows', 'Squats']
+    assert catalogStats()["rebuilds"] == rebuilds + 1 and catalogStats()["version"] == 2
+
+    # exercises created with a template bump the version too
+    template = {
+        'name': 'Catalog template',
+        'sessions': [{'name': 'Session', 'order': 1, 'coach_exercises': [{'category': 'Arms', 'name': 'Curls', 'order': 1}]}]
+    }
+    result, code = request(client, "POST", "/coach/template", data=template)
+    assert code == 200
+    result, code = request(client, "GET", "/exercises")
+    assert len(result['exercises']) == 3
+
+    # the cache is only dropped once the write commits, a rolled back write keeps it
+    bumpCatalogVersion()
+    assert catalogStats()["version"] == 3
+    db_session.rollback()
+    assert catalogStats()["version"] == 3
+    bumpCatalogVersion()
+    db_session.commit()
+    assert catalogStats()["version"] == None
+
+def test_exercise_catalog_sync(client, db_session):
+    sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+
+    # creating an exercise returns only the new exercise and the new catalog version
+    for name in ['Squats', 'Lunges']:
+        result, code = request(client, "POST", "/exercise", data={'category': 'Legs', 'name': name})
+        assert code == 200
+    assert [exercise['name'] for exercise in result['exercises']] == ['Lunges']
+    assert result['version'] == 2 and result['exercises'][0]['version'] == 2
+
+    resp = client.get('/exercises')
+    assert resp.status_code == 200
+    assert resp.json['version'] == 2 and len(resp.json['exercises']) == 2
+    etag = resp.headers['ETag']
+
+    # clients with the current catalog get a 304
+    resp = client.get('/exercises', headers={'If-None-Match': etag})
+    assert resp.status_code == 304 and resp.data == b''
+
+    # clients sync the exercises added since their version
+    result, code = request(client, "POST", "/exercise", data={'category': 'Back', 'name': 'Rows'})
+    assert result['version'] == 3
+    resp = client.get('/exercises', headers={'If-None-Match': etag})
+    assert resp.status_code == 200 and resp.headers['ETag'] != etag
+    result, code = request(client, "GET", "/exercises?since=2")
+    assert code == 200
+    assert [exercise['name'] for exercise in result['exercises']] == ['Rows'] and result['version'] == 3
+    result, code = request(client, "GET", "/exercises?since=3")
+    assert result['exercises'] == []
+
+    result, code = request(client, "GET", "/exercises?since=latest")
+    assert code == 400
+
 # TRAINING LOG
 def test_get_client_training_logs(client, db_session):
     # Create a coach to create the template and a client to assign it to
@@ -1769,3 +2663,194 @@ def test_submit_checkin(client, db_session):
     assert resp['sessions'][0]['completed'] == True
     assert resp['sessions'][0]['completed_date'] == (date.today() + timedelta(days=resp['sessions'][0]['order'])).strftime(DATE_FORMAT)
     assert resp['check_in']['coach_comment'] == "Template completed"
+
+def test_submit_checkin_background_photos(client, db_session, monkeypatch, tmp_path):
+    uploaded = []
+    def addImage(album, image):
+        uploaded.append(image.read())
+        return 'https://i.imgur.com/' + str(len(uploaded)) + '.jpg', 'deletehash', 200
+    monkeypatch.setattr(backend.helpers.albums, 'createAlbum', lambda: ('album', 'album-deletehash', 200))
+    monkeypatch.setattr(backend.helpers.photo_uploads, 'addImage', addImage)
+    monkeypatch.setitem(app.config, "PHOTO_UPLOAD_MODE", 'background')
+    monkeypatch.setitem(app.config, "PHOTO_SPOOL_DIR", str(tmp_path))
+
+    # Create a coach, a client and the clients template
+    coach_user = sign_up_user_for_testing(client, test_coach)
+    assert coach_user['user'] != None
+    client_user = sign_up_user_for_testing(client, test_client)
+    assert client_user['user'] != None
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    resp, code, coach_template = create_client_template(client, db_session, client_user['user']['id'])
+    assert code == 200
+    check_in = db_session.query(CheckIn).first()
+    assert check_in != None
+
+    # the checkin is committed without waiting for imgur, the photos are spooled
+    body = {
+        "check_in": {
+            "client_comment": "Photos attached",
+            "id": check_in.id
+        }
+    }
+    resp = client.put('/submitCheckin', data={
+        'body': json.dumps(body),
+        'front': (io.BytesIO(b'front photo'), 'front.jpg'),
+        'side_a': (io.BytesIO(b'side photo'), 'side_a.jpg')
+    }, content_type='multipart/form-data')
+    assert resp.status_code == 200
+    assert resp.json['check_in']['client_comment'] == "Photos attached"
+    assert resp.json['check_in']['front'] == None
+    assert [(upload['field'], upload['status']) for upload in resp.json['uploads']] == [('front', 'PENDING'), ('side_a', 'PENDING')]
+    assert len(os.listdir(str(tmp_path))) == 2
+    assert uploaded == []
+
+    # workers on other hosts can't reach the spool and leave the photos alone
+    host = app.config["PHOTO_SPOOL_HOST"]
+    monkeypatch.setitem(app.config, "PHOTO_SPOOL_HOST", 'other-host')
+    with app.app_context():
+        assert processPhotoUploads()['uploaded'] == 0
+    assert len(os.listdir(str(tmp_path))) == 2
+    monkeypatch.setitem(app.config, "PHOTO_SPOOL_HOST", host)
+
+    # the worker uploads the photos and backfills the links
+    with app.app_context():
+        assert processPhotoUploads()['uploaded'] == 2
+    assert sorted(uploaded) == [b'front photo', b'side photo']
+    check_in = CheckIn.query.get(check_in.id)
+    assert check_in.front != None and check_in.side_a != None and check_in.back == None
+    assert os.listdir(str(tmp_path)) == []
+
+    # the status endpoint reports each photo
+    photos, code = request(client, "GET", '/checkin/photos?checkin_id={}'.format(check_in.id))
+    assert code == 200
+    assert [(upload['field'], upload['status']) for upload in photos['uploads']] == [('front', 'DONE'), ('side_a', 'DONE')]
+    assert photos['uploads'][0]['link'] == check_in.front
+
+    resp, code = request(client, "GET", '/checkin/photos')
+    assert code == 400
+
+def test_streaming_uploads(client, db_session, monkeypatch):
+    monkeypatch.setattr(SpoolingRequest, 'spool_threshold', 1024)
+    monkeypatch.setattr(SpoolingRequest, 'max_part_size', 64 * 1024)
+
+    # small parts stay in memory, larger ones are spooled to a temporary file
+    with app.test_request_context('/submitCheckin', method='PUT', content_type='multipart/form-data', data={
+        'body': '{}',
+        'front': (io.BytesIO(b'a' * 100), 'front.jpg'),
+        'back': (io.BytesIO(b'b' * 10000), 'back.jpg')
+    }):
+        assert flask_request.files['front'].stream.spooled == False
+        assert flask_request.files['back'].stream.spooled == True
+        assert flask_request.files['back'].read() == b'b' * 10000
+
+    # oversized parts and requests are rejected with a 413
+    sign_up_user_for_testing(client, test_coach)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None
+    resp = client.put('/submitCheckin', content_type='multipart/form-data', data={
+        'body': json.dumps({"check_in": {"id": 1}}),
+        'front': (io.BytesIO(b'a' * (65 * 1024)), 'front.jpg')
+    })
+    assert resp.status_code == 413
+    assert 'error' in resp.json
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 1024)
+    resp = client.put('/submitCheckin', content_type='multipart/form-data', data={
+        'body': json.dumps({"check_in": {"id": 1}}),
+        'front': (io.BytesIO(b'a' * 2048), 'front.jpg')
+    })
+    assert resp.status_code == 413
+
+    # photos are streamed to imgur as multipart bodies that can be replayed on retries
+    image = io.BytesIO(b'photo bytes')
+    body = MultipartBody({"album": 'album-deletehash'}, 'image', image)
+    sent = b''.join(body)
+    assert len(sent) == len(body) and b''.join(body) == sent
+    with app.test_request_context('/', method='POST', content_type=body.content_type, data=sent):
+        assert flask_request.form['album'] == 'album-deletehash'
+        assert flask_request.files['image'].read() == b'photo bytes'
+
+def test_local_photo_store(client, db_session, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, "PHOTO_STORE", 'local')
+    monkeypatch.setitem(app.config, "PHOTO_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(backend.helpers.photo_store, '_store', None)
+    photo = io.BytesIO()
+    Image.new('RGB', (10, 10), (255, 0, 0)).save(photo, format='PNG')
+
+    # the same photo is stored once, whichever album it is added to
+    album_id, album, code = backend.helpers.albums.createAlbum()
+    assert code == 200
+    link, deletehash, code = backend.helpers.albums.addImage(album, io.BytesIO(photo.getvalue()))
+    assert code == 200
+    assert link == '/photos/' + deletehash and deletehash.endswith('.png')
+    other_link, other_deletehash, code = backend.helpers.albums.addImage('other-album', io.BytesIO(photo.getvalue()))
+    assert other_link == link
+    assert sorted(os.listdir(str(tmp_path))) == [deletehash[:2], 'tmp']
+    assert os.listdir(str(tmp_path / deletehash[:2])) == [deletehash]
+    assert os.listdir(str(tmp_path / 'tmp')) == []
+    jpeg = io.BytesIO()
+    Image.new('RGB', (10, 10), (0, 255, 0)).save(jpeg, format='JPEG')
+    assert backend.helpers.albums.addImage(album, io.BytesIO(jpeg.getvalue()))[1].endswith('.jpeg')
+    assert backend.helpers.albums.addImage(album, io.BytesIO(b'not an image'))[1].endswith('.bin')
+
+    # a photo failing while it streams leaves nothing behind
+    class BrokenStream(object):
+        def read(self, size):
+            raise IOError('connection reset')
+    with pytest.raises(IOError):
+        backend.helpers.albums.addImage(album, BrokenStream())
+    assert os.listdir(str(tmp_path / 'tmp')) == []
+
+    # photos are served with cache headers and answer conditional requests
+    resp = client.get(link)
+    assert resp.status_code == 200
+    assert resp.data == photo.getvalue()
+    assert resp.mimetype == 'image/png'
+    assert 'immutable' in resp.headers['Cache-Control']
+    resp = client.get(link, headers={'If-None-Match': resp.headers['ETag']})
+    assert resp.status_code == 304
+    assert client.get('/photos/' + '0' * 64 + '.png').status_code == 404
+    assert client.get('/photos/..%2F..%2Fsecret').status_code == 404
+
+def test_checkin_thumbnails(client, db_session, monkeypatch, tmp_path):
+    uploaded = []
+    def addImage(album, image):
+        uploaded.append(image.read())
+        return 'https://i.imgur.com/' + str(len(uploaded)) + '.jpg', 'deletehash', 200
+    monkeypatch.setattr(backend.helpers.albums, 'createAlbum', lambda: ('album', 'album-deletehash', 200))
+    monkeypatch.setattr(backend.helpers.albums, 'addImage', addImage)
+    monkeypatch.setattr(backend.helpers.photo_uploads, 'addImage', addImage)
+    monkeypatch.setitem(app.config, "PHOTO_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "PHOTO_THUMBNAILS", True)
+
+    coach_user = sign_up_user_for_testing(client, test_coach)
+    client_user = sign_up_user_for_testing(client, test_client)
+    login_resp = login_user_for_testing(client, test_coach)
+    assert login_resp['user']['id'] != None and login_resp['user']['id'] != ""
+    resp, code, coach_template = create_client_template(client, db_session, client_user['user']['id'])
+    assert code == 200
+    check_in = db_session.query(CheckIn).first()
+
+    # the photo is uploaded with the check in, its thumbnail is made by the photo upload worker
+    photo = io.BytesIO()
+    Image.new('RGB', (1200, 900), (0, 120, 255)).save(photo, format='JPEG')
+    resp = client.put('/submitCheckin', data={
+        'body': json.dumps({"check_in": {"id": check_in.id}}),
+        'front': (io.BytesIO(photo.getvalue()), 'front.jpg')
+    }, content_type='multipart/form-data')
+    assert resp.status_code == 200
+    assert resp.json['check_in']['front'] == 'https://i.imgur.com/1.jpg'
+    assert [(upload['field'], upload['link'], upload['status']) for upload in resp.json['uploads']] == [('front', 'https://i.imgur.com/1.jpg', 'PENDING')]
+
+    with app.app_context():
+        assert processPhotoUploads()['uploaded'] == 1
+    assert len(uploaded) == 2
+    assert max(Image.open(io.BytesIO(uploaded[1])).size) == app.config["THUMBNAIL_SIZE"]
+    assert os.listdir(str(tmp_path)) == []
+
+    # check ins return the thumbnails unless the originals are asked for
+    check_in = CheckIn.query.get(check_in.id)
+    assert check_in.front == 'https://i.imgur.com/1.jpg' and check_in.front_thumbnail == 'https://i.imgur.com/2.jpg'
+    assert check_in_schema.dump(check_in)['front'] == 'https://i.imgur.com/2.jpg'
+    assert check_in_original_schema.dump(check_in)['front'] == 'https://i.imgur.com/1.jpg'
+    assert 'front_thumbnail' not in check_in_schema.dump(check_in)